@@ -1,13 +1,20 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, session
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
-from database import init_db, get_db_connection
+from database import init_db, init_app, get_db_connection, settings_report
 from models import User, Class, Subject, Result, Enrollment, Student
-from auth import LoginUser
+from auth import IDENTITY, LoginUser, teacher_access, teaches_in_class, teaches_subject
 import sqlite3
+import result_stats
+import jobs
+import metrics
+import sql_profiler
+import write_queue
 from excel_utils import ExcelImporter
+from pagination import page_size
 import os
 import datetime
+import multiprocessing
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
@@ -25,11 +32,27 @@ login_manager.login_message_category = 'info'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return LoginUser.get(user_id)
+    return LoginUser.load(user_id)
 
-# Initialize database
+# Initialize database (pooled connections are released at app-context teardown)
+init_app(app)
 init_db()
 
+# Per-request SQL counts and timings (X-SQL-* headers, debug panel, slow log)
+sql_profiler.init_app(app)
+
+# Prometheus metrics at /metrics
+metrics.init_app(app)
+
+# Password-hashing workers import this module again; only the app's own
+# process runs the write queue and the import job runner
+if multiprocessing.parent_process() is None:
+    # Optional single-writer queue that group-commits result writes
+    write_queue.init_app(app)
+
+    # Excel uploads are imported by a background job runner
+    jobs.init_app(app)
+
 # Routes
 @app.route('/')
 def index():
@@ -64,6 +87,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    session.pop(IDENTITY, None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
@@ -83,42 +107,28 @@ def admin_dashboard():
     total_classes = cursor.execute('SELECT COUNT(*) FROM classes').fetchone()[0]
     total_subjects = cursor.execute('SELECT COUNT(*) FROM subjects').fetchone()[0]
     
-    overall_stats_query = '''
-        SELECT 
-            COUNT(*) as total_results,
-            AVG((marks_obtained * 100.0) / total_marks) as average_percentage,
-            MAX((marks_obtained * 100.0) / total_marks) as topper_score
-        FROM results
-    '''
-    overall_stats_raw = cursor.execute(overall_stats_query).fetchone()
-    
-    if overall_stats_raw['total_results'] == 0:
-        overall_stats = {
-            'total_results': 0, 'average_percentage': 0, 'pass_percentage': 0, 'topper_score': 0
-        }
-    else:
-        pass_percentage_raw = cursor.execute(
-            'SELECT (SELECT COUNT(*) FROM results WHERE (marks_obtained * 100.0) / total_marks >= 50) * 100.0 / COUNT(*) FROM results'
-        ).fetchone()[0]
-        overall_stats = dict(overall_stats_raw)
-        overall_stats['pass_percentage'] = pass_percentage_raw or 0
+    # Averages come from the result_stats_* summary tables, which triggers
+    # keep current, so this page no longer scans the results table
+    overall_stats = result_stats.overall(conn)
     
     subject_performance = cursor.execute('''
         SELECT 
             s.subject_name as name, s.subject_code as code,
-            AVG((r.marks_obtained * 100.0) / r.total_marks) as average,
-            COUNT(DISTINCT r.student_id) as student_count
-        FROM results r JOIN subjects s ON r.subject_id = s.id
-        GROUP BY s.id, s.subject_name, s.subject_code ORDER BY average DESC
+            st.average_percentage as average,
+            st.student_count
+        FROM result_stats_subject st JOIN subjects s ON st.subject_id = s.id
+        WHERE st.result_count > 0
+        ORDER BY average DESC
     ''').fetchall()
     
     class_performance = cursor.execute('''
         SELECT 
             c.class_name, c.section,
-            AVG((r.marks_obtained * 100.0) / r.total_marks) as average,
-            COUNT(DISTINCT r.student_id) as student_count
-        FROM results r JOIN classes c ON r.class_id = c.id
-        GROUP BY c.id, c.class_name, c.section ORDER BY average DESC
+            st.average_percentage as average,
+            st.student_count
+        FROM result_stats_class st JOIN classes c ON st.class_id = c.id
+        WHERE st.result_count > 0
+        ORDER BY average DESC
     ''').fetchall()
     
     recent_results = cursor.execute('''
@@ -135,14 +145,13 @@ def admin_dashboard():
     top_performers = cursor.execute('''
         SELECT 
             u.name as student_name, c.class_name, c.section,
-            AVG((r.marks_obtained * 100.0) / r.total_marks) as average_percentage
-        FROM results r
-        JOIN users u ON r.student_id = u.id
+            st.average_percentage
+        FROM result_stats_student st
+        JOIN users u ON st.student_id = u.id
         JOIN student_enrollment se ON u.id = se.student_id
         JOIN classes c ON se.class_id = c.id
-        GROUP BY r.student_id, u.name, c.class_name, c.section
-        HAVING COUNT(DISTINCT r.subject_id) >= 3
-        ORDER BY average_percentage DESC LIMIT 5
+        WHERE st.subject_count >= 3
+        ORDER BY st.average_percentage DESC LIMIT 5
     ''').fetchall()
     
     conn.close()
@@ -154,6 +163,24 @@ def admin_dashboard():
                          class_performance=class_performance, recent_results=recent_results,
                          top_performers=top_performers)
 
+@app.route('/admin/db_settings')
+@login_required
+def db_settings():
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Access denied!'})
+    
+    return jsonify({'success': True, 'settings': settings_report()})
+
+def page_links(next_cursor):
+    """First/next page URLs for a keyset-paginated listing, keeping its filters."""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('format', None)
+    return {
+        'first_url': url_for(request.endpoint, **args) if 'after' in request.args else None,
+        'next_url': url_for(request.endpoint, **args, after=next_cursor) if next_cursor else None,
+    }
+
 @app.route('/admin/manage_all_results')
 @login_required
 def manage_all_results():
@@ -161,12 +188,31 @@ def manage_all_results():
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
     
-    results = Result.get_all_results()
+    filters = {
+        'class_id': request.args.get('class_id', type=int),
+        'subject_id': request.args.get('subject_id', type=int),
+        'exam_type': request.args.get('exam_type') or None,
+        'academic_year': request.args.get('academic_year') or None,
+    }
+    results, next_cursor = Result.get_results_page(
+        after=request.args.get('after'), limit=page_size(request.args.get('limit')), **filters
+    )
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'results': [dict(r) for r in results],
+                        'next_cursor': next_cursor})
     
+    exam_types, academic_years = Result.get_filter_options()
     return render_template('manage_results.html', 
                          results=results,
                          title="Manage All Results",
-                         user_role='admin')
+                         user_role='admin',
+                         pages=page_links(next_cursor),
+                         filters=filters,
+                         classes=Class.get_all_classes(),
+                         subjects=Subject.get_all_subjects(),
+                         exam_types=exam_types,
+                         academic_years=academic_years)
 
 @app.route('/admin/manage_users')
 @login_required
@@ -175,8 +221,17 @@ def manage_users():
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
     
-    users = User.get_all_users()
-    return render_template('manage_users.html', users=users)
+    role = request.args.get('role') or None
+    users, next_cursor = User.get_users_page(
+        after=request.args.get('after'), limit=page_size(request.args.get('limit')), role=role
+    )
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'users': [dict(u) for u in users],
+                        'next_cursor': next_cursor})
+    
+    return render_template('manage_users.html', users=users, role=role,
+                           pages=page_links(next_cursor))
 
 @app.route('/admin/add_user', methods=['POST'])
 @login_required
@@ -482,7 +537,7 @@ def teacher_dashboard():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    subjects_taught = User.get_subjects_taught(current_user.id)
+    subjects_taught = teacher_access(current_user.id)['subjects']
     
     total_students_query = '''
         SELECT COUNT(DISTINCT se.student_id)
@@ -532,9 +587,7 @@ def class_stats(class_id):
     ).fetchone()
 
     # We also check if the teacher teaches *any* subject in this class
-    subjects_taught_in_class = User.get_teachable_subjects_for_class(current_user.id, class_id)
-    
-    if not class_info or not subjects_taught_in_class:
+    if not class_info or not teaches_in_class(current_user.id, class_id):
         conn.close()
         return jsonify({'success': False, 'message': 'Access denied!'})
     
@@ -542,15 +595,12 @@ def class_stats(class_id):
         'SELECT COUNT(*) FROM student_enrollment WHERE class_id = ?', (class_id,)
     ).fetchone()[0] or 0
     
-    total_results = cursor.execute(
-        'SELECT COUNT(*) FROM results WHERE class_id = ?', (class_id,)
-    ).fetchone()[0] or 0
-    
-    average_result = cursor.execute('''
-        SELECT AVG((marks_obtained * 100.0) / total_marks) as avg_percentage
-        FROM results WHERE class_id = ?
-    ''', (class_id,)).fetchone()
-    average_percentage = round(average_result['avg_percentage'] or 0, 2)
+    class_totals = cursor.execute(
+        'SELECT result_count, average_percentage FROM result_stats_class WHERE class_id = ?',
+        (class_id,)
+    ).fetchone()
+    total_results = class_totals['result_count'] if class_totals else 0
+    average_percentage = round((class_totals['average_percentage'] if class_totals else 0) or 0, 2)
     
     top_subjects = cursor.execute('''
         SELECT s.subject_name as name, 
@@ -585,8 +635,7 @@ def teacher_manage_results_by_subject(subject_id):
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
         
-    subjects_taught_raw = User.get_subjects_taught(current_user.id)
-    if subject_id not in {s['id'] for s in subjects_taught_raw}:
+    if not teaches_subject(current_user.id, subject_id):
         flash('Access denied! You do not teach this subject.', 'danger')
         return redirect(url_for('teacher_dashboard'))
         
@@ -686,27 +735,13 @@ def enter_marks_by_subject(subject_id):
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
 
-    subjects_taught_raw = User.get_subjects_taught(current_user.id)
-    subjects_taught_ids = {s['id'] for s in subjects_taught_raw}
-    
-    if subject_id not in subjects_taught_ids:
+    if not teaches_subject(current_user.id, subject_id):
         flash('Access denied! You are not assigned to teach this subject.', 'danger')
         return redirect(url_for('teacher_dashboard'))
         
     subject = Subject.get_subject_by_id(subject_id)
 
-    classes_with_subject = Class.get_classes_for_subject(subject_id)
-    
-    students_by_class = []
-    for c in classes_with_subject:
-        students = User.get_students_in_class(c['id'])
-        if students:
-            students_by_class.append({
-                'id': c['id'],
-                'name': c['class_name'],
-                'section': c['section'],
-                'students': students
-            })
+    students_by_class = Class.get_rosters_for_subject(subject_id)
 
     current_year = datetime.date.today().year
     academic_year = f"{current_year}-{current_year + 1}"
@@ -723,8 +758,7 @@ def submit_marks_by_subject(subject_id):
     if current_user.role != 'teacher':
         return jsonify({'success': False, 'message': 'Access denied!'})
 
-    subjects_taught_raw = User.get_subjects_taught(current_user.id)
-    if subject_id not in {s['id'] for s in subjects_taught_raw}:
+    if not teaches_subject(current_user.id, subject_id):
         return jsonify({'success': False, 'message': 'Access denied! You do not teach this subject.'})
 
     try:
@@ -736,7 +770,7 @@ def submit_marks_by_subject(subject_id):
         
         student_ids = request.form.getlist('student_id')
         
-        success_count = 0
+        entries = []
         fail_count = 0
         
         for student_id_str in student_ids:
@@ -747,27 +781,24 @@ def submit_marks_by_subject(subject_id):
             
             if marks and total:
                 try:
-                    marks_obtained = float(marks)
-                    total_marks = float(total)
-                    class_id_int = int(class_id)
-                    
-                    result_id, message = Result.enter_marks(
+                    entries.append((
                         student_id,
                         subject_id,
-                        class_id_int,
-                        current_user.id, 
-                        marks_obtained,
-                        total_marks,
+                        int(class_id),
+                        current_user.id,
+                        float(marks),
+                        float(total),
                         exam_type,
                         academic_year
-                    )
-                    if result_id:
-                        success_count += 1
-                    else:
-                        fail_count += 1
+                    ))
                 except Exception as e:
                     fail_count += 1
         
+        # All rows are validated together and written in one transaction
+        outcomes = Result.enter_marks_bulk(entries)
+        success_count = sum(1 for success, _ in outcomes if success)
+        fail_count += len(outcomes) - success_count
+        
         flash(f'Successfully submitted {success_count} results. Failed or skipped {fail_count} entries.', 'success')
         return jsonify({'success': True})
 
@@ -781,8 +812,7 @@ def view_results_by_subject(subject_id):
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
         
-    subjects_taught_raw = User.get_subjects_taught(current_user.id)
-    if subject_id not in {s['id'] for s in subjects_taught_raw}:
+    if not teaches_subject(current_user.id, subject_id):
         flash('Access denied! You do not teach this subject.', 'danger')
         return redirect(url_for('teacher_dashboard'))
         
@@ -898,6 +928,37 @@ def download_template(template_type):
         flash('Error generating template', 'danger')
         return redirect(url_for('upload_data'))
 
+def queue_import(kind, file):
+    """Hand an uploaded file to the background job runner."""
+    job_id = jobs.submit(kind, file, current_user.id)
+    return {
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'message': 'File uploaded. Importing in the background...'
+    }
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = jobs.status(job_id)
+    if job is None or (job['created_by'] != current_user.id and current_user.role != 'admin'):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    job = jobs.status(job_id)
+    if job is None or (job['created_by'] != current_user.id and current_user.role != 'admin'):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    errors_sent = request.headers.get('Last-Event-ID', '0')
+    errors_sent = int(errors_sent) if errors_sent.isdigit() else 0
+    # No app context in the stream: each read borrows a pooled connection
+    # instead of pinning one for as long as the client listens
+    return Response(jobs.events(job_id, errors_sent), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/admin/upload_users', methods=['POST'])
 @login_required
 def upload_users():
@@ -915,8 +976,7 @@ def upload_users():
         return jsonify({'success': False, 'message': 'Please upload an Excel file (.xlsx or .xls)'})
     
     try:
-        success, message = ExcelImporter.import_users(file)
-        return jsonify({'success': success, 'message': message})
+        return jsonify(queue_import('users', file))
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
 
@@ -937,8 +997,7 @@ def upload_subjects():
         return jsonify({'success': False, 'message': 'Please upload an Excel file (.xlsx or .xls)'})
     
     try:
-        success, message = ExcelImporter.import_subjects(file)
-        return jsonify({'success': success, 'message': message})
+        return jsonify(queue_import('subjects', file))
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
 
@@ -959,8 +1018,7 @@ def upload_students():
         return jsonify({'success': False, 'message': 'Please upload an Excel file (.xlsx or .xls)'})
     
     try:
-        success, message = ExcelImporter.import_students(file)
-        return jsonify({'success': success, 'message': message})
+        return jsonify(queue_import('students', file))
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
 
@@ -981,8 +1039,7 @@ def upload_classes():
         return jsonify({'success': False, 'message': 'Please upload an Excel file (.xlsx or .xls)'})
     
     try:
-        success, message = ExcelImporter.import_classes(file)
-        return jsonify({'success': success, 'message': message})
+        return jsonify(queue_import('classes', file))
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
 
@@ -1003,8 +1060,7 @@ def upload_results():
         return jsonify({'success': False, 'message': 'Please upload an Excel file (.xlsx or .xls)'})
     
     try:
-        success, message = ExcelImporter.import_results(file)
-        return jsonify({'success': success, 'message': message})
+        return jsonify(queue_import('results', file))
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
 
@@ -1030,19 +1086,18 @@ def teacher_upload_results():
             return redirect(url_for('teacher_upload_results'))
         
         try:
-            success, message = ExcelImporter.import_results(file)
-            if success:
-                flash(message, 'success')
-            else:
-                flash(message, 'danger')
+            job = queue_import('results', file)
+            flash('File uploaded. Your results are being imported in the background.', 'info')
+            return redirect(url_for('teacher_upload_results', job=job['job_id']))
         except Exception as e:
             flash(f'Error processing file: {str(e)}', 'danger')
         
         return redirect(url_for('teacher_upload_results'))
     
-    subjects_taught = User.get_subjects_taught(current_user.id)
+    subjects_taught = teacher_access(current_user.id)['subjects']
     
-    return render_template('teacher_upload_results.html', subjects=subjects_taught)
+    return render_template('teacher_upload_results.html', subjects=subjects_taught,
+                           job_id=request.args.get('job'))
 
 
 @app.route('/admin/manage_students')
@@ -1052,7 +1107,18 @@ def manage_students():
         flash('Access denied!', 'danger')
         return redirect(url_for('index'))
     
-    students = Student.get_all_students()
+    filters = {
+        'class_id': request.args.get('class_id', type=int),
+        'academic_year': request.args.get('academic_year') or None,
+    }
+    students, next_cursor = Student.get_students_page(
+        after=request.args.get('after'), limit=page_size(request.args.get('limit')), **filters
+    )
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'students': [dict(s) for s in students],
+                        'next_cursor': next_cursor})
+    
     classes = Class.get_all_classes()
     
     current_year = datetime.date.today().year
@@ -1061,7 +1127,9 @@ def manage_students():
     return render_template('manage_students.html', 
                          students=students, 
                          classes=classes,
-                         academic_year=academic_year)
+                         academic_year=academic_year,
+                         filters=filters,
+                         pages=page_links(next_cursor))
 
 @app.route('/admin/add_student', methods=['POST'])
 @login_required
@@ -1153,7 +1221,7 @@ def search_students():
         return jsonify({'success': False, 'message': 'Access denied!'})
     
     query = request.form.get('query', '')
-    students = Student.search_students(query)
+    students = Student.search_students(query, limit=page_size(request.form.get('limit')))
     
     students_list = [dict(student) for student in students]
     
@@ -1,6 +1,12 @@
+from flask import session
 from flask_login import UserMixin
+import cache_versions
+import metrics
 from models import User
 
+# Session key holding the logged-in user's identity
+IDENTITY = 'identity'
+
 class LoginUser(UserMixin):
     def __init__(self, user_id, username, role, name):
         self.id = user_id
@@ -13,4 +19,64 @@ class LoginUser(UserMixin):
         user = User.get_by_id(user_id)
         if user:
             return LoginUser(user.id, user.username, user.role, user.name)
-        return None
\ No newline at end of file
+        return None
+
+    @staticmethod
+    def load(user_id):
+        """
+        The logged-in user for Flask-Login's user_loader. The identity is
+        kept in the session with the user's stamp, so the users table is
+        only read again after update_user, update_student or delete_user
+        has changed this user.
+        """
+        stamp = cache_versions.current(cache_versions.user_identity(user_id))
+        identity = session.get(IDENTITY)
+        hit = bool(identity) and str(identity['id']) == str(user_id) and identity['stamp'] == stamp
+        metrics.cache_lookup('identity', hit)
+        if hit:
+            return LoginUser(identity['id'], identity['username'], identity['role'], identity['name'])
+
+        user = LoginUser.get(user_id)
+        if user is None:
+            session.pop(IDENTITY, None)
+            return None
+        session[IDENTITY] = {'id': user.id, 'username': user.username, 'role': user.role,
+                             'name': user.name, 'stamp': stamp}
+        return user
+
+
+def teacher_access(teacher_id):
+    """
+    The subjects a teacher is assigned and the classes taking them, as
+    returned by User.get_teacher_access. Looked up at most once per request
+    and kept in the session with the teacher_access stamp, so later requests
+    only re-query after an assignment has changed.
+    """
+    memo = cache_versions.memo(cache_versions.TEACHER_ACCESS)
+    if teacher_id in memo:
+        metrics.cache_lookup('teacher_access', True)
+        return memo[teacher_id]
+
+    # Read the stamp before the rows so a change made in between is not
+    # stored under the new stamp
+    stamp = cache_versions.current(cache_versions.TEACHER_ACCESS)
+    cached = session.get(cache_versions.TEACHER_ACCESS)
+    hit = bool(cached) and cached['teacher_id'] == teacher_id and cached['stamp'] == stamp
+    metrics.cache_lookup('teacher_access', hit)
+    if hit:
+        access = cached['access']
+    else:
+        access = User.get_teacher_access(teacher_id)
+        session[cache_versions.TEACHER_ACCESS] = {'teacher_id': teacher_id, 'stamp': stamp, 'access': access}
+
+    memo[teacher_id] = access
+    return access
+
+
+def teaches_subject(teacher_id, subject_id):
+    return any(subject['id'] == subject_id for subject in teacher_access(teacher_id)['subjects'])
+
+
+def teaches_in_class(teacher_id, class_id):
+    """Whether the teacher teaches any subject of the class."""
+    return class_id in teacher_access(teacher_id)['class_ids']
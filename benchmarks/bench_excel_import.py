@@ -0,0 +1,115 @@
+"""
+Peak memory and throughput of parsing an uploaded results workbook.
+
+Compares the old full-mode load (openpyxl.load_workbook building every
+cell object) with ExcelImporter's read-only streaming reader. Each parse runs
+in its own subprocess so ru_maxrss is that run's peak RSS.
+
+    python -m benchmarks.bench_excel_import                # 10k, 100k, 500k rows
+    python -m benchmarks.bench_excel_import --rows 20000 --keep
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+RESULT_HEADERS = ['student_username', 'subject_code', 'marks_obtained',
+                  'total_marks', 'exam_type', 'academic_year']
+
+
+def generate_workbook(path, rows):
+    """Write a results upload with `rows` data rows (write-only, so it is cheap)."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Results')
+    ws.append(RESULT_HEADERS)
+    for i in range(rows):
+        ws.append([f'student{i % 5000}', f'SUB{i % 40}', (i * 7) % 101, 100,
+                   ('Mid Term', 'Final')[i % 2], '2024-2025'])
+    wb.save(path)
+
+
+def parse_full(path):
+    """What every ExcelImporter.import_* method used to do."""
+    wb = openpyxl.load_workbook(path)
+    ws = wb.active
+    headers = [cell.value.lower().strip() for cell in ws[1]]
+    count = 0
+    for row in ws.iter_rows(min_row=2):
+        dict(zip(headers, [cell.value for cell in row]))
+        count += 1
+    return count
+
+
+def parse_streaming(path):
+    from excel_utils import ExcelImporter
+
+    count = 0
+    with open(path, 'rb') as stream:
+        headers, chunks = ExcelImporter._read_chunks(stream)
+        for chunk in chunks:
+            count += len(chunk)
+    return count
+
+
+def run_child(path, mode):
+    """Parse once in this process and print rows, seconds and peak RSS as JSON."""
+    parse = parse_full if mode == 'full' else parse_streaming
+    start = time.perf_counter()
+    rows = parse(path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    print(json.dumps({'rows': rows, 'seconds': elapsed, 'peak_rss_mb': peak_mb}))
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(path, mode):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_excel_import', '--child', mode, path],
+        check=True, capture_output=True, text=True,
+        cwd=REPO_ROOT,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, action='append',
+                        help="data rows per workbook (repeatable; default 10k, 100k, 500k)")
+    parser.add_argument('--modes', default='full,streaming')
+    parser.add_argument('--keep', action='store_true', help="keep the generated workbooks")
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[1], args.child[0])
+        return 0
+
+    sizes = args.rows or [10_000, 100_000, 500_000]
+    workdir = tempfile.mkdtemp(prefix='excel-bench-')
+    print(f"{'rows':>9} {'mode':>10} {'rows/sec':>12} {'peak RSS MB':>12}")
+    for size in sizes:
+        path = os.path.join(workdir, f'results_{size}.xlsx')
+        generate_workbook(path, size)
+        for mode in args.modes.split(','):
+            stats = measure(path, mode)
+            rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+            print(f"{size:>9} {mode:>10} {rate:>12,.0f} {stats['peak_rss_mb']:>12.1f}")
+        if not args.keep:
+            os.remove(path)
+    if args.keep:
+        print(f"Workbooks kept in {workdir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Latency, SQL statements and memory of the main Flask routes at several
+dataset sizes.
+
+Each size gets a database from benchmarks.synthetic_data (built once and
+reused from --workdir) and its own subprocess, which drives the real routes
+through the Flask test client as the admin and a teacher. For every route
+it reports p50/p95/p99 latency, SQL statements per request (from the
+X-SQL-Count header) and the peak Python allocation of one request
+(tracemalloc). Upload routes are timed end to end: the request plus the
+background import job it queues.
+
+    python -m benchmarks.bench_routes --sizes small,medium --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_routes --sizes small,medium --compare benchmarks/baseline.json
+
+With --compare the run fails (exit status 1) when a route's p95 exceeds
+the baseline's by more than --budget (a ratio, overridable per route with
+--route-budget) and by at least --min-delta-ms, or when it issues more SQL
+statements than before.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {
+    'small': {'classes': 10, 'students': 500, 'subjects': 20, 'results': 20_000},
+    'medium': {'classes': 50, 'students': 5000, 'subjects': 40, 'results': 200_000},
+    'large': {'classes': 50, 'students': 5000, 'subjects': 40, 'results': 2_000_000},
+}
+
+# Rows per upload file; account files are smaller because of password hashing
+UPLOAD_ROWS = 200
+UPLOAD_ACCOUNT_ROWS = 10
+
+PASSWORD = 'password'
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def build_dataset(workdir, size):
+    """Generate (or reuse) the database and upload files for a size."""
+    from benchmarks import synthetic_data
+
+    path = os.path.join(workdir, f'{size}.db')
+    uploads = os.path.join(workdir, f'{size}-uploads')
+    if not os.path.exists(path):
+        options = [f'--{name}={value}' for name, value in SIZES[size].items()]
+        synthetic_data.main(['--database', path, '--password', PASSWORD, *options,
+                             '--excel', uploads, '--excel-rows', str(UPLOAD_ROWS),
+                             '--excel-account-rows', str(UPLOAD_ACCOUNT_ROWS)])
+    return path, uploads
+
+
+class RouteRunner:
+    """Logged-in test clients and the routes to drive (runs in the child)."""
+
+    def __init__(self, uploads):
+        import app as app_module
+        import jobs
+        from database import get_db_connection
+        from models import Class
+
+        self.jobs = jobs
+        self.uploads = uploads
+        app = app_module.app
+        app.config['TESTING'] = True
+        app.config['SQL_HEADERS'] = True
+        self.admin = app.test_client()
+        self.teacher = app.test_client()
+        self._login(self.admin, 'admin', 'admin123')
+        self._login(self.teacher, 'teacher1', PASSWORD)
+
+        conn = get_db_connection()
+        teacher = conn.execute("SELECT id FROM users WHERE username = 'teacher1'").fetchone()
+        self.subject_id = conn.execute(
+            'SELECT subject_id FROM teacher_subject_assignments WHERE teacher_id = ? ORDER BY subject_id',
+            (teacher['id'],)
+        ).fetchone()['subject_id']
+        academic_year = conn.execute('SELECT MAX(academic_year) FROM results').fetchone()[0]
+        conn.close()
+
+        rosters = Class.get_rosters_for_subject(self.subject_id)
+        self.class_id = rosters[0]['id']
+        self.marks_form = {'exam_type': 'Benchmark', 'academic_year': academic_year,
+                           'student_id': [str(student['id']) for student in rosters[0]['students']]}
+        for student in rosters[0]['students']:
+            self.marks_form[f"marks_{student['id']}"] = '75'
+            self.marks_form[f"total_{student['id']}"] = '100'
+            self.marks_form[f"class_{student['id']}"] = str(self.class_id)
+
+    @staticmethod
+    def _login(client, username, password):
+        response = client.post('/login', data={'username': username, 'password': password})
+        if response.status_code != 302:
+            raise RuntimeError(f"Could not log in as {username}")
+
+    def routes(self):
+        """(name, callable making one request and returning the response)."""
+        routes = [
+            ('admin_dashboard', lambda: self.admin.get('/admin/dashboard')),
+            ('manage_all_results', lambda: self.admin.get('/admin/manage_all_results')),
+            ('manage_all_results (filtered)', lambda: self.admin.get(
+                f'/admin/manage_all_results?subject_id={self.subject_id}')),
+            ('search_students', lambda: self.admin.post('/admin/search_students',
+                                                        data={'query': 'ar', 'limit': 20})),
+            ('search_students (substring)', lambda: self.admin.post('/admin/search_students',
+                                                                    data={'query': 'harm', 'limit': 20})),
+            ('teacher_dashboard', lambda: self.teacher.get('/teacher/dashboard')),
+            ('class_stats', lambda: self.teacher.get(f'/teacher/class_stats/{self.class_id}')),
+            ('enter_marks_by_subject', lambda: self.teacher.get(
+                f'/teacher/enter_marks_by_subject/{self.subject_id}')),
+            ('submit_marks_by_subject', lambda: self.teacher.post(
+                f'/teacher/submit_marks_by_subject/{self.subject_id}', data=self.marks_form)),
+        ]
+        for kind in ('results', 'subjects', 'classes', 'students', 'users'):
+            routes.append((f'upload_{kind}', lambda kind=kind: self.upload(kind)))
+        return routes
+
+    def upload(self, kind):
+        """Post an upload file and wait for its import job to finish."""
+        with open(os.path.join(self.uploads, f'{kind}.xlsx'), 'rb') as f:
+            data = f.read()
+        response = self.admin.post(f'/admin/upload_{kind}', data={'file': (io.BytesIO(data), f'{kind}.xlsx')},
+                                   content_type='multipart/form-data')
+        job_id = response.get_json()['job_id']
+        while self.jobs.status(job_id)['status'] in ('queued', 'running'):
+            time.sleep(0.005)
+        return response
+
+
+def run_child(database, uploads, requests, upload_requests, warmup):
+    """Benchmark every route against one database and print JSON."""
+    import logging
+
+    # Routes that write (marks, uploads) work on a copy, so every run
+    # starts from the same generated data
+    scratch = tempfile.mkdtemp(prefix='bench-routes-')
+    os.environ['SCHOOL_RESULTS_DB'] = shutil.copy(database, os.path.join(scratch, 'bench.db'))
+    os.chdir(scratch)
+    sys.path.insert(0, REPO_ROOT)
+    # Slow requests are the point here; don't log each one
+    logging.getLogger('sql_profiler').setLevel(logging.ERROR)
+
+    runner = RouteRunner(uploads)
+    report = {}
+    for name, request in runner.routes():
+        count = upload_requests if name.startswith('upload_') else requests
+        for _ in range(0 if name.startswith('upload_') else warmup):
+            request()
+
+        latencies = []
+        statements = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name} returned {response.status_code}")
+            statements.append(int(response.headers.get('X-SQL-Count', 0)))
+
+        tracemalloc.start()
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        report[name] = {
+            'requests': count,
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'sql_statements': max(statements),
+            'peak_alloc_kb': round(peak / 1024, 1),
+        }
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    print(json.dumps({'routes': report, 'peak_rss_mb': round(peak_rss_mb, 1)}))
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+def measure(database, uploads, args):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_routes', '--child', database, uploads,
+         '--requests', str(args.requests), '--upload-requests', str(args.upload_requests),
+         '--warmup', str(args.warmup)],
+        check=True, capture_output=True, text=True, cwd=REPO_ROOT,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(current, baseline, budget, route_budgets, min_delta_ms):
+    """Regressions of current against baseline, as printable strings."""
+    regressions = []
+    for size, run in current['sizes'].items():
+        base_run = baseline.get('sizes', {}).get(size)
+        if base_run is None:
+            continue
+        for route, stats in run['routes'].items():
+            base = base_run['routes'].get(route)
+            if base is None:
+                continue
+            allowed = route_budgets.get(route, budget)
+            if stats['p95_ms'] > base['p95_ms'] * allowed and stats['p95_ms'] - base['p95_ms'] >= min_delta_ms:
+                regressions.append(f"{size} {route}: p95 {stats['p95_ms']:.1f}ms vs baseline "
+                                   f"{base['p95_ms']:.1f}ms (budget x{allowed})")
+            if stats['sql_statements'] > base['sql_statements']:
+                regressions.append(f"{size} {route}: {stats['sql_statements']} SQL statements vs "
+                                   f"baseline {base['sql_statements']}")
+    return regressions
+
+
+def parse_route_budgets(values):
+    budgets = {}
+    for value in values or []:
+        route, _, ratio = value.rpartition('=')
+        if not route:
+            raise argparse.ArgumentTypeError(f"--route-budget expects ROUTE=RATIO, got {value}")
+        budgets[route] = float(ratio)
+    return budgets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium', help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument('--requests', type=int, default=30, help="measured requests per route")
+    parser.add_argument('--upload-requests', type=int, default=3, help="measured requests per upload route")
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--workdir', help="where generated datasets are kept between runs")
+    parser.add_argument('--output', help="write this run's results as JSON")
+    parser.add_argument('--save-baseline', metavar='PATH', help="write this run as the new baseline")
+    parser.add_argument('--compare', metavar='PATH', help="fail on regressions against this baseline")
+    parser.add_argument('--budget', type=float, default=1.5, help="allowed p95 ratio to the baseline")
+    parser.add_argument('--route-budget', action='append', metavar='ROUTE=RATIO')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help="ignore p95 increases smaller than this")
+    parser.add_argument('--child', nargs=2, metavar=('DATABASE', 'UPLOADS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.requests, args.upload_requests, args.warmup)
+        return 0
+
+    sizes = args.sizes.split(',')
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown size: {', '.join(unknown)}")
+    route_budgets = parse_route_budgets(args.route_budget)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-routes-')
+    os.makedirs(workdir, exist_ok=True)
+    current = {
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'requests': args.requests,
+        'sizes': {},
+    }
+    for size in sizes:
+        database, uploads = build_dataset(workdir, size)
+        run = measure(database, uploads, args)
+        current['sizes'][size] = run
+        print(f"\n{size} ({SIZES[size]['results']:,} results), peak RSS {run['peak_rss_mb']:.0f} MB")
+        print(f"{'route':<32} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'SQL':>5} {'peak KB':>9}")
+        for route, stats in run['routes'].items():
+            print(f"{route:<32} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+                  f"{stats['sql_statements']:>5} {stats['peak_alloc_kb']:>9.0f}")
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nWrote {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.budget, route_budgets, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
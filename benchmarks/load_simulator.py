@@ -0,0 +1,307 @@
+"""
+Exam-day load against a running server.
+
+Logs in as many synthetic teachers and students (from a database built by
+benchmarks.synthetic_data, which the server must be using too) and has
+each of them act on its own thread at the configured per-minute rates:
+
+    teachers   submit_marks_by_subject for one of their classes,
+               teacher_dashboard reads and class_stats polling
+    students   my_results views
+
+Think times are exponentially distributed, so the rates are averages.
+With --burst every teacher submits marks at the same moment first, the
+"80 teachers press submit at once" case.
+
+A response counts as "locked" when SQLite's "database is locked" /
+"database table is locked" reaches the client (as a JSON message or a
+500 page). Locked requests are retried up to --retries times with
+jittered backoff; the report gives throughput, p50/p95/p99/max latency,
+errors, requests still locked after their retries and the retries made,
+per action, and the change in any lock or retry counters the server
+exports on /metrics.
+
+    python app.py    # or gunicorn, pointed at the same database
+    python -m benchmarks.load_simulator --database /tmp/scale.db --teachers 80 \\
+        --students 200 --duration 120 --burst
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_routes import percentile
+
+LOCKED = re.compile(rb'database (table )?is locked')
+
+
+class Stats:
+    """Outcomes per action, shared by every virtual user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.actions = {}
+
+    def record(self, action, seconds, outcome, retries):
+        with self.lock:
+            entry = self.actions.setdefault(action, {
+                'latencies': [], 'ok': 0, 'errors': 0, 'locked': 0, 'retries': 0,
+            })
+            entry['latencies'].append(seconds * 1000)
+            entry[outcome] += 1
+            entry['retries'] += retries
+
+    def report(self, elapsed):
+        report = {}
+        for action, entry in sorted(self.actions.items()):
+            latencies = entry['latencies']
+            report[action] = {
+                'requests': len(latencies),
+                'per_second': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.50), 1),
+                'p95_ms': round(percentile(latencies, 0.95), 1),
+                'p99_ms': round(percentile(latencies, 0.99), 1),
+                'max_ms': round(max(latencies), 1),
+                'errors': entry['errors'],
+                'locked': entry['locked'],
+                'retries': entry['retries'],
+            }
+        return report
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, password, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, path, form=None):
+        """(status, body) of one request; redirects are followed."""
+        data = urllib.parse.urlencode(form, doseq=True).encode() if form is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=self.timeout) as response:
+                return response.status, response.read(), response.geturl()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.geturl()
+
+    def login(self):
+        status, _, url = self.request('/login', {'username': self.username, 'password': self.password})
+        if status != 200 or urllib.parse.urlparse(url).path == '/login':
+            raise RuntimeError(f"Could not log in as {self.username}")
+
+
+def classify(status, body):
+    if LOCKED.search(body):
+        return 'locked'
+    if status >= 400:
+        return 'errors'
+    if body.startswith(b'{'):
+        try:
+            if json.loads(body).get('success') is False:
+                return 'errors'
+        except ValueError:
+            return 'errors'
+    return 'ok'
+
+
+def perform(user, stats, action, path, form, args, rng):
+    """One logical request, retried while the database is locked."""
+    retries = 0
+    start = time.perf_counter()
+    while True:
+        status, body, _ = user.request(path, form)
+        outcome = classify(status, body)
+        if outcome != 'locked' or retries >= args.retries:
+            break
+        retries += 1
+        time.sleep(rng.uniform(0, args.retry_backoff * 2 ** retries))
+    stats.record(action, time.perf_counter() - start, outcome, retries)
+
+
+def load_accounts(database, teachers, students, seed):
+    """Teachers with a subject and a class roster for it, and student usernames."""
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('''
+        SELECT u.id, u.username, tsa.subject_id, MIN(cs.class_id) AS class_id
+        FROM users u
+        JOIN teacher_subject_assignments tsa ON tsa.teacher_id = u.id
+        JOIN class_subjects cs ON cs.subject_id = tsa.subject_id
+        WHERE u.role = 'teacher'
+        GROUP BY u.id
+        ORDER BY u.id
+    ''').fetchall()
+    if len(rows) < teachers:
+        raise SystemExit(f"Only {len(rows)} teachers have a class to enter marks for")
+    accounts = []
+    for row in rows[:teachers]:
+        roster = [r[0] for r in conn.execute(
+            'SELECT student_id FROM student_enrollment WHERE class_id = ? ORDER BY student_id',
+            (row['class_id'],)
+        )]
+        accounts.append(dict(row, roster=roster))
+
+    student_names = [r[0] for r in conn.execute("SELECT username FROM users WHERE role = 'student' ORDER BY id")]
+    academic_year = conn.execute('SELECT MAX(academic_year) FROM results').fetchone()[0]
+    conn.close()
+    if len(student_names) < students:
+        raise SystemExit(f"Only {len(student_names)} students in the database")
+    return accounts, random.Random(seed).sample(student_names, students), academic_year
+
+
+def marks_form(teacher, exam_type, academic_year, rng):
+    form = {'exam_type': exam_type, 'academic_year': academic_year, 'student_id': teacher['roster']}
+    for student_id in teacher['roster']:
+        form[f'marks_{student_id}'] = rng.randrange(0, 101)
+        form[f'total_{student_id}'] = 100
+        form[f'class_{student_id}'] = teacher['class_id']
+    return form
+
+
+def run_user(user, actions, stats, args, rng, deadline, start_gate, burst=None):
+    """actions: list of (per-minute rate, name, path, form factory)."""
+    start_gate.wait()
+    if burst is not None:
+        name, path, form = burst
+        perform(user, stats, name, path, form(), args, rng)
+    total_rate = sum(rate for rate, *_ in actions)
+    if total_rate <= 0:
+        return
+    while True:
+        wake = time.time() + rng.expovariate(total_rate / 60)
+        if wake >= deadline:
+            return
+        time.sleep(wake - time.time())
+        pick = rng.uniform(0, total_rate)
+        for rate, name, path, form in actions:
+            pick -= rate
+            if pick <= 0:
+                break
+        perform(user, stats, name, path, form() if form else None, args, rng)
+
+
+def server_counters(base_url, timeout):
+    """Lock/retry counters from the server's /metrics, if it exports any."""
+    try:
+        with urllib.request.urlopen(base_url.rstrip('/') + '/metrics', timeout=timeout) as response:
+            text = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return {}
+    counters = {}
+    for line in text.splitlines():
+        if line.startswith('#') or not line.strip():
+            continue
+        name, _, value = line.rpartition(' ')
+        if ('lock' in name or 'retr' in name) and name.split('{')[0].endswith('_total'):
+            counters[name] = float(value)
+    return counters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--database', default=os.environ.get('SCHOOL_RESULTS_DB', 'school_results.db'),
+                        help="the server's database, to find accounts, subjects and rosters")
+    parser.add_argument('--password', default='password', help="password of the synthetic accounts")
+    parser.add_argument('--teachers', type=int, default=80)
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=60, help="seconds of load after login")
+    parser.add_argument('--submit-per-minute', type=float, default=1, help="per teacher")
+    parser.add_argument('--dashboard-per-minute', type=float, default=2, help="per teacher")
+    parser.add_argument('--stats-per-minute', type=float, default=6, help="class_stats polls per teacher")
+    parser.add_argument('--results-per-minute', type=float, default=1, help="my_results views per student")
+    parser.add_argument('--burst', action='store_true', help="every teacher submits marks at once first")
+    parser.add_argument('--exam-type', default='Load Test')
+    parser.add_argument('--academic-year', help="default: the latest year in the database")
+    parser.add_argument('--retries', type=int, default=3, help="client retries of a locked request")
+    parser.add_argument('--retry-backoff', type=float, default=0.05, help="base backoff in seconds")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    teachers, student_names, latest_year = load_accounts(args.database, args.teachers, args.students, args.seed)
+    academic_year = args.academic_year or latest_year
+
+    stats = Stats()
+    users = []
+    print(f"Logging in {len(teachers)} teachers and {len(student_names)} students...")
+    login_start = time.perf_counter()
+    for index, teacher in enumerate(teachers):
+        rng = random.Random(args.seed * 1000 + index)
+        user = VirtualUser(args.url, teacher['username'], args.password, args.timeout)
+        submit_path = f"/teacher/submit_marks_by_subject/{teacher['subject_id']}"
+        form = (lambda teacher=teacher, rng=rng: marks_form(teacher, args.exam_type, academic_year, rng))
+        actions = [
+            (args.submit_per_minute, 'submit_marks_by_subject', submit_path, form),
+            (args.dashboard_per_minute, 'teacher_dashboard', '/teacher/dashboard', None),
+            (args.stats_per_minute, 'class_stats', f"/teacher/class_stats/{teacher['class_id']}", None),
+        ]
+        burst = ('submit_marks_by_subject (burst)', submit_path, form) if args.burst else None
+        users.append((user, actions, rng, burst))
+    for index, username in enumerate(student_names):
+        rng = random.Random(args.seed * 1000 + len(teachers) + index)
+        user = VirtualUser(args.url, username, args.password, args.timeout)
+        users.append((user, [(args.results_per_minute, 'my_results', '/student/my_results', None)], rng, None))
+    # Each login is a password check on the server, so do several at once
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda entry: entry[0].login(), users))
+    print(f"Logged in {len(users)} users in {time.perf_counter() - login_start:.1f}s")
+
+    counters_before = server_counters(args.url, args.timeout)
+    start_gate = threading.Barrier(len(users) + 1)
+    deadline = time.time() + args.duration
+    threads = [threading.Thread(target=run_user, daemon=True,
+                                args=(user, actions, stats, args, rng, deadline, start_gate, burst))
+               for user, actions, rng, burst in users]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    counters_after = server_counters(args.url, args.timeout)
+
+    report = stats.report(elapsed)
+    totals = {key: sum(entry[key] for entry in report.values())
+              for key in ('requests', 'errors', 'locked', 'retries')}
+    print(f"\n{totals['requests']} requests in {elapsed:.1f}s ({totals['requests'] / elapsed:.1f}/s), "
+          f"{totals['locked']} locked, {totals['errors']} other errors, {totals['retries']} client retries")
+    print(f"{'action':<34} {'req':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'err':>5} {'locked':>6} {'retry':>6}")
+    for action, entry in report.items():
+        print(f"{action:<34} {entry['requests']:>6} {entry['per_second']:>7.2f} {entry['p50_ms']:>8.1f} "
+              f"{entry['p95_ms']:>8.1f} {entry['p99_ms']:>8.1f} {entry['max_ms']:>8.1f} "
+              f"{entry['errors']:>5} {entry['locked']:>6} {entry['retries']:>6}")
+
+    server = {name: value - counters_before.get(name, 0) for name, value in counters_after.items()
+              if value != counters_before.get(name, 0)}
+    if server:
+        print("\nServer lock/retry counters during the run:")
+        for name, delta in sorted(server.items()):
+            print(f"  {name} +{delta:g}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'elapsed_seconds': round(elapsed, 2), 'totals': totals,
+                       'actions': report, 'server_counters': server}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,401 @@
+"""
+Build a school results database full of deterministic synthetic data.
+
+The same seed and sizes always give the same rows, so a slow page or a
+query plan can be reproduced at production scale on any machine. The
+schema comes from the app's own migrations; rows go in with executemany in
+one transaction, and the results table's indexes and summary triggers are
+dropped during the load and rebuilt once at the end.
+
+    python -m benchmarks.synthetic_data --database /tmp/scale.db
+    python -m benchmarks.synthetic_data --database /tmp/small.db --classes 10 \\
+        --students 500 --results 50000 --excel /tmp/uploads --excel-rows 5000
+
+Every generated account has the password given by --password (hashed once;
+hashing thousands of passwords would take longer than the whole load).
+With --excel the generator also writes users, subjects, classes, students
+and results upload files that import cleanly into the generated database:
+new teachers, subjects and classes, new students in the existing classes
+and results for the academic year after the last generated one.
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import openpyxl
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import database  # noqa: E402
+import result_stats  # noqa: E402
+
+SECTIONS = 'ABCDE'
+
+# (exam type, month it is held in, counted from the July the year starts)
+EXAMS = [('Unit Test 1', 0), ('Unit Test 2', 2), ('Mid Term', 3), ('Pre-Board', 6), ('Final', 8)]
+
+SUBJECT_NAMES = [
+    'English', 'Hindi', 'Mathematics', 'Physics', 'Chemistry', 'Biology', 'History',
+    'Geography', 'Civics', 'Economics', 'Computer Science', 'Sanskrit', 'Physical Education',
+    'Art', 'Music', 'Accountancy', 'Business Studies', 'Psychology', 'Sociology',
+    'Political Science', 'Environmental Science', 'Home Science', 'French', 'German',
+]
+
+FIRST_NAMES = [
+    'Aarav', 'Vivaan', 'Aditya', 'Vihaan', 'Arjun', 'Sai', 'Reyansh', 'Krishna', 'Ishaan',
+    'Rohan', 'Kabir', 'Rahul', 'Ananya', 'Diya', 'Saanvi', 'Aadhya', 'Pari', 'Anika',
+    'Navya', 'Myra', 'Sara', 'Riya', 'Kavya', 'Meera', 'Priya', 'Neha', 'Isha', 'Tara',
+]
+LAST_NAMES = [
+    'Sharma', 'Verma', 'Gupta', 'Singh', 'Kumar', 'Patel', 'Reddy', 'Nair', 'Iyer',
+    'Das', 'Bose', 'Mehta', 'Joshi', 'Rao', 'Yadav', 'Chauhan', 'Malhotra', 'Kapoor',
+]
+
+
+def password_hash(password, seed, iterations=600000):
+    """A werkzeug-compatible pbkdf2 hash with a salt derived from the seed."""
+    salt = hashlib.sha256(f'synthetic-{seed}'.encode()).hexdigest()[:16]
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations).hex()
+    return f'pbkdf2:sha256:{iterations}${salt}${digest}'
+
+
+def academic_years(first_year, count):
+    return [f'{year}-{year + 1}' for year in range(first_year, first_year + count)]
+
+
+def exam_date(academic_year, month_offset):
+    start = int(academic_year[:4])
+    month = 7 + month_offset
+    return datetime.date(start + (month - 1) // 12, (month - 1) % 12 + 1, 10)
+
+
+def class_names(count):
+    """Class 1 A..E, Class 2 A..E, ... for as many classes as asked."""
+    return [(f'Class {1 + i // len(SECTIONS)}', SECTIONS[i % len(SECTIONS)]) for i in range(count)]
+
+
+def subject_names(count):
+    names = []
+    for i in range(count):
+        base = SUBJECT_NAMES[i % len(SUBJECT_NAMES)]
+        names.append(base if i < len(SUBJECT_NAMES) else f'{base} {i // len(SUBJECT_NAMES) + 1}')
+    return names
+
+
+def person_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+class Generator:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.years = academic_years(args.first_year, args.years)
+        self.exams = EXAMS[:args.exam_types]
+        self.hash = password_hash(args.password, args.seed)
+        # Fixed instead of CURRENT_TIMESTAMP so reruns give identical rows
+        self.created_at = f'{args.first_year}-06-01 08:00:00'
+
+    def build(self, conn):
+        args = self.args
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+
+        teacher_ids = self._insert_users(cursor, [
+            (f'teacher{i + 1}', 'teacher', person_name(self.rng)) for i in range(args.teachers)
+        ])
+
+        self.subjects = subject_names(args.subjects)
+        cursor.executemany(
+            'INSERT INTO subjects (subject_name, subject_code) VALUES (?, ?)',
+            [(name, f'SUB{i + 1:03d}') for i, name in enumerate(self.subjects)]
+        )
+        subject_ids = self._ids(cursor, 'subjects')
+
+        # Every subject gets a teacher; extra teachers double up on subjects
+        subject_teachers = {subject_id: [] for subject_id in subject_ids}
+        assignments = []
+        for i, teacher_id in enumerate(teacher_ids):
+            subject_id = subject_ids[i % len(subject_ids)]
+            subject_teachers[subject_id].append(teacher_id)
+            assignments.append((teacher_id, subject_id))
+        cursor.executemany(
+            'INSERT INTO teacher_subject_assignments (teacher_id, subject_id) VALUES (?, ?)', assignments
+        )
+
+        self.classes = class_names(args.classes)
+        cursor.executemany(
+            'INSERT INTO classes (class_name, section, teacher_id) VALUES (?, ?, ?)',
+            [(name, section, teacher_ids[i % len(teacher_ids)])
+             for i, (name, section) in enumerate(self.classes)]
+        )
+        class_ids = self._ids(cursor, 'classes')
+
+        per_class = min(args.subjects_per_class, len(subject_ids))
+        class_subjects = {}
+        for class_id in class_ids:
+            class_subjects[class_id] = sorted(self.rng.sample(subject_ids, per_class))
+        cursor.executemany(
+            'INSERT INTO class_subjects (class_id, subject_id, created_at) VALUES (?, ?, ?)',
+            [(class_id, subject_id, self.created_at)
+             for class_id, ids in class_subjects.items() for subject_id in ids]
+        )
+
+        students = self._students(class_ids)
+        student_user_ids = self._insert_users(cursor, [
+            (username, 'student', full_name) for username, full_name, *_ in students
+        ])
+        cursor.executemany('''
+            INSERT INTO students (user_id, student_id, full_name, gender, date_of_birth, class_id,
+                                  roll_number, fathers_name, mothers_name, mobile_number,
+                                  created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_id, f'S{user_id:04d}', *student[1:], self.created_at, self.created_at)
+              for user_id, student in zip(student_user_ids, students)])
+        cursor.executemany(
+            'INSERT INTO student_enrollment (student_id, class_id, academic_year) VALUES (?, ?, ?)',
+            [(user_id, student[4], self.years[-1]) for user_id, student in zip(student_user_ids, students)]
+        )
+
+        roster = [(user_id, student[4]) for user_id, student in zip(student_user_ids, students)]
+        self.results_inserted = self._insert_results(cursor, roster, class_subjects, subject_teachers)
+        conn.commit()
+
+        self.roster = roster
+        self.class_subjects = class_subjects
+        self.class_ids = class_ids
+        self.usernames = {user_id: student[0] for user_id, student in zip(student_user_ids, students)}
+        self.subject_codes = {subject_id: f'SUB{i + 1:03d}' for i, subject_id in enumerate(subject_ids)}
+        self.max_roll = len(students)
+
+    def _insert_users(self, cursor, users):
+        first = cursor.execute('SELECT IFNULL(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        cursor.executemany(
+            'INSERT INTO users (username, password, role, name, email, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(username, self.hash, role, name, f'{username}@example.com', self.created_at)
+             for username, role, name in users]
+        )
+        return list(range(first, first + len(users)))
+
+    @staticmethod
+    def _ids(cursor, table):
+        return [row[0] for row in cursor.execute(f'SELECT id FROM {table} ORDER BY id')]
+
+    def _students(self, class_ids, first_roll=1):
+        """
+        (username, full_name, gender, date_of_birth, class_id, roll_number,
+        fathers_name, mothers_name, mobile_number) for --students students
+        spread evenly over the classes. Roll numbers run on across classes,
+        so usernames (first name + roll number) never collide.
+        """
+        students = []
+        latest_start = int(self.years[-1][:4])
+        for i in range(self.args.students):
+            class_index = i * len(class_ids) // self.args.students
+            grade = 1 + class_index // len(SECTIONS)
+            roll_number = first_roll + i
+            first_name = self.rng.choice(FIRST_NAMES)
+            last_name = self.rng.choice(LAST_NAMES)
+            birth_year = latest_start - 5 - grade
+            date_of_birth = datetime.date(birth_year, 1, 1) + datetime.timedelta(days=self.rng.randrange(365))
+            students.append((
+                f'{first_name.lower()}{roll_number}',
+                f'{first_name} {last_name}',
+                self.rng.choice(['Male', 'Female']),
+                date_of_birth.isoformat(),
+                class_ids[class_index],
+                roll_number,
+                f'{self.rng.choice(FIRST_NAMES)} {last_name}',
+                f'{self.rng.choice(FIRST_NAMES)} {last_name}',
+                f'9{self.rng.randrange(10 ** 9):09d}',
+            ))
+        return students
+
+    def _insert_results(self, cursor, roster, class_subjects, subject_teachers):
+        """
+        Pick exactly --results of the possible (year, exam, student,
+        subject) results with selection sampling, in exam order so
+        created_at grows with id the way real entry does.
+        """
+        available = sum(len(class_subjects[class_id]) for _, class_id in roster) \
+            * len(self.exams) * len(self.years)
+        wanted = min(self.args.results, available)
+        if wanted < self.args.results:
+            print(f"Only {available:,} distinct results are possible at this scale; "
+                  f"generating {available:,}")
+
+        ability = {user_id: self.rng.gauss(65, 12) for user_id, _ in roster}
+        clock = [f'{h:02d}:{m:02d}:{sec:02d}' for h in range(24) for m in range(60) for sec in range(60)]
+        state = {'chosen': 0}
+
+        def rows():
+            rng = self.rng
+            random, gauss = rng.random, rng.gauss
+            seen = chosen = 0
+            for year in self.years:
+                for exam_type, month_offset in self.exams:
+                    # Entry starts at 09:00 on the exam date, one result a second
+                    held = exam_date(year, month_offset)
+                    held_on = held.isoformat()
+                    days = [(held + datetime.timedelta(days=day)).isoformat() for day in range(64)]
+                    entered = 9 * 3600
+                    for user_id, class_id in roster:
+                        mean = ability[user_id]
+                        for subject_id in class_subjects[class_id]:
+                            # Keep this one with probability still needed / still to see
+                            if random() * (available - seen) >= wanted - chosen:
+                                seen += 1
+                                continue
+                            seen += 1
+                            chosen += 1
+                            day, second = divmod(entered, 86400)
+                            entered += 1
+                            teachers = subject_teachers[subject_id]
+                            marks = min(100.0, max(0.0, round(gauss(mean, 15) * 2) / 2))
+                            yield (user_id, subject_id, class_id, teachers[user_id % len(teachers)],
+                                   marks, 100.0, exam_type, held_on, year,
+                                   f'{days[day]} {clock[second]}')
+            state['chosen'] = chosen
+
+        # Indexes and summary triggers are rebuilt once instead of per row
+        saved = cursor.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE tbl_name = 'results' AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+        ).fetchall()
+        for kind, name, _ in saved:
+            cursor.execute(f'DROP {kind.upper()} {name}')
+        cursor.executemany('''
+            INSERT INTO results (student_id, subject_id, class_id, teacher_id, marks_obtained,
+                                 total_marks, exam_type, exam_date, academic_year, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows())
+        for _, _, sql in saved:
+            cursor.execute(sql)
+        result_stats.rebuild(cursor.connection)
+        return state['chosen']
+
+    def write_excel(self, directory, rows, account_rows=None):
+        """
+        Upload files that import into the generated database without
+        conflicts. The users and students files get account_rows rows
+        (default rows), since every account costs a password hash.
+        """
+        account_rows = rows if account_rows is None else account_rows
+        os.makedirs(directory, exist_ok=True)
+        rng = random.Random(self.args.seed + 1)
+        written = {}
+
+        def save(name, headers, data):
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet(name.capitalize())
+            ws.append(headers)
+            count = 0
+            for row in data:
+                ws.append(row)
+                count += 1
+            path = os.path.join(directory, f'{name}.xlsx')
+            wb.save(path)
+            written[path] = count
+
+        save('users', ['username', 'password', 'role', 'name', 'email'],
+             ((f'newteacher{i + 1}', self.args.password, 'teacher', person_name(rng),
+               f'newteacher{i + 1}@example.com') for i in range(account_rows)))
+        save('subjects', ['subject_name', 'subject_code'],
+             ((f'Elective {i + 1}', f'EL{i + 1:05d}') for i in range(rows)))
+        save('classes', ['class_name', 'section', 'teacher_username'],
+             ((f'Batch {i // len(SECTIONS) + 1}', SECTIONS[i % len(SECTIONS)],
+               f'teacher{i % self.args.teachers + 1}') for i in range(rows)))
+
+        class_lookup = dict(zip(self.class_ids, self.classes))
+        new_year = academic_years(self.args.first_year + self.args.years, 1)[0]
+
+        def students():
+            for i in range(account_rows):
+                class_id = self.class_ids[i % len(self.class_ids)]
+                class_name, section = class_lookup[class_id]
+                roll_number = self.max_roll + i + 1
+                first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                yield (f'{first_name} {last_name}', f'{first_name.lower()}{roll_number}@example.com',
+                       rng.choice(['Male', 'Female']),
+                       (datetime.date(2010, 1, 1) + datetime.timedelta(days=rng.randrange(3650))).isoformat(),
+                       class_name, section, roll_number, f'{rng.choice(FIRST_NAMES)} {last_name}',
+                       f'{rng.choice(FIRST_NAMES)} {last_name}', f'9{rng.randrange(10 ** 9):09d}', new_year)
+
+        save('students', ['full_name', 'email', 'gender', 'date_of_birth', 'class_name', 'section',
+                          'roll_number', 'fathers_name', 'mothers_name', 'mobile_number', 'academic_year'],
+             students())
+
+        def results():
+            count = 0
+            for exam_type, _ in self.exams:
+                for user_id, class_id in self.roster:
+                    for subject_id in self.class_subjects[class_id]:
+                        if count == rows:
+                            return
+                        count += 1
+                        yield (self.usernames[user_id], self.subject_codes[subject_id],
+                               rng.randrange(0, 201) / 2, 100, exam_type, new_year)
+
+        save('results', ['student_username', 'subject_code', 'marks_obtained', 'total_marks',
+                         'exam_type', 'academic_year'], results())
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', required=True, help="database file to create")
+    parser.add_argument('--force', action='store_true', help="replace the database if it exists")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--classes', type=int, default=50)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--subjects', type=int, default=40)
+    parser.add_argument('--subjects-per-class', type=int, default=25)
+    parser.add_argument('--teachers', type=int, default=60)
+    parser.add_argument('--results', type=int, default=2_000_000)
+    parser.add_argument('--years', type=int, default=4, help="academic years of results")
+    parser.add_argument('--first-year', type=int, default=2021)
+    parser.add_argument('--exam-types', type=int, default=len(EXAMS), choices=range(1, len(EXAMS) + 1))
+    parser.add_argument('--password', default='password', help="password of every generated account")
+    parser.add_argument('--excel', metavar='DIR', help="also write upload files to DIR")
+    parser.add_argument('--excel-rows', type=int, default=10_000, help="rows per upload file")
+    parser.add_argument('--excel-account-rows', type=int,
+                        help="rows in the users and students files (default --excel-rows)")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error(f"{args.database} exists; pass --force to replace it")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+
+    start = time.perf_counter()
+    database.configure_pool(args.database)
+    database.init_db()
+    database.get_pool().close_all()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    generator = Generator(args)
+    generator.build(conn)
+    conn.execute('ANALYZE')
+    conn.close()
+    print(f"{args.database}: {args.classes} classes, {args.students:,} students, {args.subjects} subjects, "
+          f"{generator.results_inserted:,} results in {time.perf_counter() - start:.1f}s")
+
+    if args.excel:
+        for path, count in generator.write_excel(args.excel, args.excel_rows,
+                                                   args.excel_account_rows).items():
+            print(f"{path}: {count:,} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
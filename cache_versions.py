@@ -0,0 +1,96 @@
+"""
+Version stamps for data cached outside the database.
+
+Some lookups that every request needs (a teacher's subject assignments,
+the logged-in user's identity) are kept in the signed session together
+with the stamp of the data they were read from. Code that changes the
+underlying rows calls bump(name); a reader compares its cached stamp with
+current(name) and reloads on a mismatch, so a change takes effect on the
+very next request.
+
+Stamps live in small files next to the database (<database>.stamps/<name>)
+so that every worker process sees them and checking one costs a file read
+rather than a connection and a query. A stamp is a random token replaced
+with an atomic rename, so concurrent writers need no lock. A stamp that
+does not exist yet is created with a fresh token on first read, so after
+reset_database.py removes the directory along with the database, sessions
+cached against the old one no longer match.
+
+Within one request, memo(name) is a dict for caching the same lookups in
+flask.g; bump() clears it too.
+"""
+import os
+import shutil
+import uuid
+
+from flask import g, has_app_context
+
+import database
+
+# Teachers' subject assignments and the classes taking those subjects
+TEACHER_ACCESS = 'teacher_access'
+
+
+def user_identity(user_id):
+    """Stamp name for one user's login identity (username, role, name)."""
+    return f'user-{user_id}'
+
+
+def _directory():
+    return os.path.abspath(database.get_pool().database) + '.stamps'
+
+
+def _path(name):
+    return os.path.join(_directory(), name)
+
+
+def clear():
+    """Forget every stamp, e.g. when the database is replaced."""
+    shutil.rmtree(_directory(), ignore_errors=True)
+
+
+def _write(path, exclusive=False):
+    """Write a new token to path; with exclusive, only if path does not exist yet."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{uuid.uuid4().hex}'
+    token = uuid.uuid4().hex
+    with open(temp_path, 'w') as f:
+        f.write(token)
+    if not exclusive:
+        os.replace(temp_path, path)
+        return token
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        # Another reader created it first
+        return None
+    finally:
+        os.remove(temp_path)
+    return token
+
+
+def current(name):
+    """The current stamp for name."""
+    path = _path(name)
+    while True:
+        try:
+            with open(path) as f:
+                token = f.read()
+        except FileNotFoundError:
+            token = _write(path, exclusive=True)
+        if token:
+            return token
+
+
+def bump(name):
+    """Invalidate everything cached under name."""
+    _write(_path(name))
+    if has_app_context():
+        g.pop(f'_memo_{name}', None)
+
+
+def memo(name):
+    """A per-request dict for caching lookups stamped by name."""
+    if not has_app_context():
+        return {}
+    return g.setdefault(f'_memo_{name}', {})
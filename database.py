@@ -1,134 +1,465 @@
 import sqlite3
+import functools
 import os
-from werkzeug.security import generate_password_hash
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+
+import metrics
+
+DATABASE = os.environ.get('SCHOOL_RESULTS_DB', 'school_results.db')
+
+# Named PRAGMA sets applied once when the pool opens a connection. Pick one
+# with SQLITE_PROFILE in app config or the SCHOOL_DB_PROFILE environment
+# variable; SQLITE_PRAGMAS in app config overrides individual values.
+TUNING_PROFILES = {
+    # SQLite's own defaults, plus a wait instead of an instant "locked" error
+    'default': {
+        'busy_timeout': 5000,
+    },
+    # WAL lets dashboard readers run while teachers are submitting marks
+    'concurrent': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,           # negative means KiB, so ~16MB
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    # Same as concurrent but fsyncs the WAL on every commit
+    'durable': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16000,
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+DEFAULT_PROFILE = os.environ.get('SCHOOL_DB_PROFILE', 'concurrent')
+
+# retry_on_busy: attempts after the first, and the backoff before attempt n
+# drawn from [0, min(BUSY_BACKOFF_MAX, BUSY_BACKOFF * 2**n)] seconds
+BUSY_RETRIES = 3
+BUSY_BACKOFF = 0.1
+BUSY_BACKOFF_MAX = 1.0
+
+# busy_timeout goes first so a journal_mode switch waits for other writers
+PRAGMA_ORDER = ['busy_timeout', 'journal_mode', 'synchronous', 'cache_size',
+                'mmap_size', 'temp_store']
+
+SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def resolve_pragmas(profile=None, overrides=None):
+    """Return the PRAGMA dict for a profile name plus any overrides."""
+    profile = profile or DEFAULT_PROFILE
+    if profile not in TUNING_PROFILES:
+        raise ValueError(f"Unknown SQLite tuning profile: {profile}")
+    pragmas = dict(TUNING_PROFILES[profile])
+    pragmas.update(overrides or {})
+    return pragmas
+
+
+def apply_pragmas(conn, pragmas):
+    ordered = sorted(pragmas, key=lambda name: PRAGMA_ORDER.index(name)
+                     if name in PRAGMA_ORDER else len(PRAGMA_ORDER))
+    for name in ordered:
+        conn.execute(f'PRAGMA {name} = {pragmas[name]}')
+
+
+def current_settings(conn):
+    """Read back the tuning PRAGMAs actually in effect on a connection."""
+    settings = {}
+    for name in PRAGMA_ORDER:
+        value = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        if name == 'synchronous':
+            value = SYNCHRONOUS_NAMES.get(value, value)
+        elif name == 'temp_store':
+            value = TEMP_STORE_NAMES.get(value, value)
+        elif name == 'journal_mode':
+            value = value.upper()
+        settings[name] = value
+    return settings
+
+
+def is_busy_error(error):
+    """True for SQLite's "database is locked" family of errors (SQLITE_BUSY/LOCKED)."""
+    return isinstance(error, sqlite3.OperationalError) and 'is locked' in str(error)
+
+
+def _run(conn, method, sql, *args):
+    """
+    Run one statement, timing it against the connection's profile and
+    remembering a busy/locked error for retry_on_busy even if the caller
+    swallows it.
+    """
+    profile = conn.profile
+    start = time.perf_counter()
+    try:
+        return method(sql, *args)
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            conn.busy_error = e
+        raise
+    finally:
+        if profile is not None:
+            profile.record(sql, time.perf_counter() - start)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """A cursor that reports its statements to the connection's profile."""
+
+    def execute(self, sql, parameters=()):
+        return _run(self.connection, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _run(self.connection, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return _run(self.connection, super().executescript, sql_script)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection that goes back to the pool instead of closing.
+
+    Model methods keep calling conn.close() as before; that only gives up
+    their lease. When the last lease is released any uncommitted work is
+    rolled back, and outside a Flask request the connection is returned to
+    the pool. Inside a request it stays on flask.g until teardown so every
+    model call in the request shares it.
+
+    While a request holds it, profile is that request's
+    sql_profiler.QueryProfile and every statement is timed against it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.leases = 0
+        self.request_bound = False
+        self.transaction_depth = 0
+        self.profile = None
+        self.busy_error = None
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return _run(self, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _run(self, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return _run(self, super().executescript, sql_script)
+
+    def commit(self):
+        # Inside transaction() the outermost block decides when to commit
+        if self.transaction_depth == 0:
+            try:
+                super().commit()
+            except sqlite3.OperationalError as e:
+                if is_busy_error(e):
+                    self.busy_error = e
+                raise
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+            return
+        if self.leases > 0:
+            self.leases -= 1
+        if self.leases == 0:
+            if self.in_transaction and self.transaction_depth == 0:
+                self.rollback()
+            if not self.request_bound:
+                self.pool.release(self)
+
+
+class ConnectionPool:
+    """Keeps up to max_idle open connections around for reuse."""
+
+    def __init__(self, database, max_idle=8, profile=None, pragmas=None):
+        self.database = database
+        self.max_idle = max_idle
+        self.profile = profile or DEFAULT_PROFILE
+        self.pragmas = resolve_pragmas(self.profile, pragmas)
+        self.in_use = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, factory=PooledConnection,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.pragmas)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self.in_use += 1
+        if conn is None:
+            conn = self._connect()
+        return conn
+
+    def release(self, conn):
+        conn.leases = 0
+        conn.request_bound = False
+        conn.transaction_depth = 0
+        conn.profile = None
+        conn.busy_error = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.pool = None
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.pool = None
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE)
+    return _pool
+
+
+def configure_pool(database, max_idle=8, profile=None, pragmas=None):
+    """Point the pool at a (possibly different) database file and profile."""
+    global _pool, DATABASE
+    new_pool = ConnectionPool(database, max_idle, profile, pragmas)
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        DATABASE = database
+        _pool = new_pool
+    return _pool
+
+
+def settings_report():
+    """Configured profile next to the values SQLite reports back."""
+    pool = get_pool()
+    conn = get_db_connection()
+    try:
+        active = current_settings(conn)
+    finally:
+        conn.close()
+    return {
+        'database': pool.database,
+        'profile': pool.profile,
+        'configured': pool.pragmas,
+        'active': active,
+    }
+
+
+def close_db(exception=None):
+    """Return the request's connection to the pool (teardown handler)."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.pool.release(conn)
+
+
+def init_app(app):
+    """Configure the pool from app config and tie connections to the app context."""
+    app.config.setdefault('DATABASE', DATABASE)
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('SQLITE_PROFILE', DEFAULT_PROFILE)
+    app.config.setdefault('SQLITE_PRAGMAS', {})
+    configure_pool(app.config['DATABASE'], app.config['DB_POOL_SIZE'],
+                   app.config['SQLITE_PROFILE'], app.config['SQLITE_PRAGMAS'])
+    app.teardown_appcontext(close_db)
+
 
 def init_db():
-    """Initialize the database with empty tables - no sample data"""
-    conn = sqlite3.connect('school_results.db')
-    cursor = conn.cursor()
-    
-    # ... (users, classes, subjects tables are the same) ...
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('admin', 'teacher', 'student')),
-            name TEXT NOT NULL,
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            class_name TEXT NOT NULL,
-            section TEXT,
-            teacher_id INTEGER,
-            FOREIGN KEY (teacher_id) REFERENCES users (id),
-            UNIQUE(class_name, section)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subjects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            subject_name TEXT NOT NULL UNIQUE,
-            subject_code TEXT UNIQUE
-        )
-    ''')
-    
-    # ... (class_subjects, student_enrollment, results, students tables are the same) ...
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS class_subjects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            class_id INTEGER NOT NULL,
-            subject_id INTEGER NOT NULL,
-            is_compulsory BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (class_id) REFERENCES classes (id),
-            FOREIGN KEY (subject_id) REFERENCES subjects (id),
-            UNIQUE(class_id, subject_id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS student_enrollment (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            class_id INTEGER NOT NULL,
-            academic_year TEXT,
-            FOREIGN KEY (student_id) REFERENCES users (id),
-            FOREIGN KEY (class_id) REFERENCES classes (id),
-            UNIQUE(student_id, class_id, academic_year)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            subject_id INTEGER NOT NULL,
-            class_id INTEGER NOT NULL,
-            teacher_id INTEGER NOT NULL,
-            marks_obtained REAL NOT NULL,
-            total_marks REAL NOT NULL,
-            exam_type TEXT,
-            exam_date DATE DEFAULT CURRENT_DATE,
-            academic_year TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (student_id) REFERENCES users (id),
-            FOREIGN KEY (subject_id) REFERENCES subjects (id),
-            FOREIGN KEY (class_id) REFERENCES classes (id),
-            FOREIGN KEY (teacher_id) REFERENCES users (id)
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            student_id TEXT UNIQUE NOT NULL,
-            full_name TEXT NOT NULL,
-            gender TEXT NOT NULL CHECK(gender IN ('Male', 'Female', 'Other')),
-            date_of_birth DATE NOT NULL,
-            class_id INTEGER NOT NULL,
-            roll_number INTEGER NOT NULL,
-            fathers_name TEXT NOT NULL,
-            mobile_number TEXT,
-            mothers_name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (class_id) REFERENCES classes (id),
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            UNIQUE(class_id, roll_number)
-        )
-    ''')
-    
-    #
-    # >>> NEW TABLE: Teacher Subject Assignments <<<
-    # This table links teachers to the subjects they are allowed to teach.
-    #
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS teacher_subject_assignments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id INTEGER NOT NULL,
-            subject_id INTEGER NOT NULL,
-            FOREIGN KEY (teacher_id) REFERENCES users (id),
-            FOREIGN KEY (subject_id) REFERENCES subjects (id),
-            UNIQUE(teacher_id, subject_id)
-        )
-    ''')
-    
-    # ... (admin user creation is the same) ...
-    hashed_password = generate_password_hash('admin123')
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (username, password, role, name, email)
-        VALUES (?, ?, ?, ?, ?)
-    ''', ('admin', hashed_password, 'admin', 'System Administrator', 'admin@school.com'))
-    
-    conn.commit()
-    conn.close()
-    print("Database initialized with empty tables")
+    """
+    Create or upgrade the schema. On an up-to-date database this is a single
+    version check, so it is cheap to call at every startup.
+    """
+    from migrations import migrate
+
+    conn = get_db_connection()
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"Database schema migrated to version {applied[-1]}")
+
+
+# Outside an app context, the connection transaction() or retry_on_busy
+# is holding for this thread; get_db_connection() hands it out
+_bound = threading.local()
+_retrying = threading.local()
+
 
 def get_db_connection():
-    """Get a database connection"""
-    conn = sqlite3.connect('school_results.db')
-    conn.row_factory = sqlite3.Row
-    return conn
\ No newline at end of file
+    """
+    Get a database connection.
+
+    Inside a Flask app context every call returns the same pooled connection
+    until teardown; elsewhere each call leases one from the pool, unless the
+    thread is inside transaction() or a retried method, which share theirs.
+    Either way callers still finish with conn.close().
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = get_pool().acquire()
+            conn.request_bound = True
+            conn.profile = g.get('_sql_profile')
+            g._db_conn = conn
+    elif getattr(_bound, 'conn', None) is not None:
+        conn = _bound.conn
+    else:
+        conn = get_pool().acquire()
+    conn.leases += 1
+    return conn
+
+
+def transaction_active():
+    """True inside a transaction() block on this thread (or this request)."""
+    if has_app_context():
+        conn = g.get('_db_conn')
+    else:
+        conn = getattr(_bound, 'conn', None)
+    return conn is not None and conn.transaction_depth > 0
+
+
+@contextmanager
+def transaction():
+    """
+    Share one transaction across several model calls.
+
+    Model methods commit as usual, but inside this block those commits are
+    deferred until the outermost block exits; an exception rolls it all back.
+    Outside an app context the block holds its connection for the thread,
+    so the model calls inside it share it as they would in a request.
+    """
+    conn = get_db_connection()
+    bound = not has_app_context() and getattr(_bound, 'conn', None) is None
+    if bound:
+        # Keep close() from handing it back to the pool inside the block
+        conn.request_bound = True
+        _bound.conn = conn
+    conn.transaction_depth += 1
+    try:
+        yield conn
+    except Exception:
+        conn.transaction_depth -= 1
+        if conn.transaction_depth == 0:
+            conn.rollback()
+        raise
+    else:
+        conn.transaction_depth -= 1
+        if conn.transaction_depth == 0:
+            conn.commit()
+    finally:
+        if bound:
+            _bound.conn = None
+            conn.pool.release(conn)
+        else:
+            conn.close()
+
+
+def busy_backoff(attempt, operation, waited):
+    """
+    Sleep before retry number attempt + 1 of a transaction that found the
+    database locked, and count the retry. waited is how long the failed
+    attempt ran, mostly spent in SQLite's busy_timeout.
+    """
+    delay = random.uniform(0, min(BUSY_BACKOFF_MAX, BUSY_BACKOFF * 2 ** attempt))
+    metrics.DB_BUSY_RETRIES.labels(operation).inc()
+    metrics.DB_LOCK_WAIT_SECONDS.labels(operation).inc(waited + delay)
+    time.sleep(delay)
+
+
+def retry_on_busy(method):
+    """
+    Retry a model method whose transaction failed on a locked database.
+
+    The method runs on one connection for the whole attempt. If any of its
+    statements or its commit reports "database is locked" - whether the
+    error escapes or the method turns it into a failure message - the
+    attempt is rolled back and the method is run again after a jittered
+    backoff, up to BUSY_RETRIES times. After that the last attempt's
+    outcome stands. Inside transaction(), or inside another retried
+    method, it runs once; the outermost caller owns the transaction.
+    """
+    operation = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(_retrying, 'active', False):
+            return method(*args, **kwargs)
+        conn = get_db_connection()
+        if conn.transaction_depth:
+            conn.close()
+            return method(*args, **kwargs)
+        bound = not has_app_context()
+        if bound:
+            # Keep close() from handing it back to the pool mid-attempt
+            conn.request_bound = True
+            _bound.conn = conn
+        _retrying.active = True
+        leases = conn.leases
+        try:
+            for attempt in range(BUSY_RETRIES + 1):
+                conn.busy_error = None
+                started = time.perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if is_busy_error(e):
+                        conn.busy_error = e
+                    if conn.busy_error is None or attempt == BUSY_RETRIES:
+                        if conn.busy_error is not None:
+                            metrics.DB_LOCK_ERRORS.labels(operation).inc()
+                        raise
+                else:
+                    if conn.busy_error is None:
+                        return result
+                    if attempt == BUSY_RETRIES:
+                        metrics.DB_LOCK_ERRORS.labels(operation).inc()
+                        return result
+                # Undo whatever the failed attempt left behind
+                conn.leases = leases
+                if conn.in_transaction:
+                    conn.rollback()
+                busy_backoff(attempt, operation, time.perf_counter() - started)
+        finally:
+            _retrying.active = False
+            if bound:
+                _bound.conn = None
+                conn.pool.release(conn)
+            else:
+                conn.leases = leases
+                conn.close()
+
+    return wrapper
@@ -1,8 +1,12 @@
 import openpyxl
 import io
 import sqlite3
+import datetime
+import itertools
 from werkzeug.security import generate_password_hash
 from database import get_db_connection
+import metrics
+from password_hashing import hash_passwords
 from models import Student, User, Subject, Class, Result
 
 #
@@ -11,8 +15,141 @@ from models import Student, User, Subject, Class, Result
 # This file should only contain the class definition.
 #
 
+def _key(value):
+    """Normalise a cell value the way SQLite compares it with a TEXT column."""
+    return None if value is None else str(value)
+
+
+def _one_ahead(items):
+    """
+    Yield each item only after the next one has been produced, so the
+    importers prepare chunk N+1 (and submit its password hashing) before
+    writing chunk N.
+    """
+    items = iter(items)
+    try:
+        current = next(items)
+    except StopIteration:
+        return
+    for upcoming in items:
+        yield current
+        current = upcoming
+    yield current
+
+
+class Lookup:
+    """
+    Memoised key -> row map. Keys missing from the cache are fetched a whole
+    chunk at a time with prefetch(), so resolving a row is a dict lookup.
+    """
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._cache = {}
+
+    def prefetch(self, keys):
+        wanted = {_key(k) for k in keys if k is not None}
+        missing = wanted - self._cache.keys()
+        metrics.cache_lookup('import_lookup', True, len(wanted) - len(missing))
+        metrics.cache_lookup('import_lookup', False, len(missing))
+        if missing:
+            found = self._fetch(sorted(missing))
+            for k in missing:
+                self._cache[k] = found.get(k)
+
+    def get(self, key):
+        key = _key(key)
+        if key is not None and key not in self._cache:
+            self.prefetch([key])
+        return self._cache.get(key)
+
+
 class ExcelImporter:
 
+    # Rows handed to the database per batch; peak memory scales with this,
+    # not with the size of the uploaded file
+    CHUNK_SIZE = 500
+
+    @staticmethod
+    def _read_chunks(file_stream, chunk_size=None):
+        """
+        Stream an uploaded workbook in read-only mode.
+
+        Returns (headers, chunks) where chunks yields lists of
+        (row_number, row_dict) of at most chunk_size rows. Blank rows are
+        skipped. The workbook is closed once the chunks are exhausted.
+        """
+        chunk_size = chunk_size or ExcelImporter.CHUNK_SIZE
+        wb = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        header_row = next(rows, None) or ()
+        headers = [str(value).lower().strip() if value is not None else '' for value in header_row]
+
+        def chunks():
+            try:
+                numbered = (
+                    (row_idx, dict(zip(headers, values)))
+                    for row_idx, values in enumerate(rows, start=2)
+                    if any(value is not None for value in values)
+                )
+                while True:
+                    chunk = list(itertools.islice(numbered, chunk_size))
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                wb.close()
+
+        return headers, chunks()
+
+    @staticmethod
+    def count_rows(file_stream):
+        """
+        Data rows in an uploaded workbook (blank rows included), from the
+        sheet's recorded dimensions. Workbooks saved without them, such as
+        openpyxl's write-only output, are read through once to count.
+        """
+        wb = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
+        try:
+            sheet = wb.active
+            if sheet.max_row is None:
+                sheet.calculate_dimension(force=True)
+            max_row = sheet.max_row
+            return max(max_row - 1, 0) if max_row else None
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _class_ids(conn):
+        """(class_name, section) -> class id, for every class."""
+        return {
+            (_key(row['class_name']), _key(row['section'])): row['id']
+            for row in conn.execute('SELECT id, class_name, section FROM classes').fetchall()
+        }
+
+    @staticmethod
+    def _subject_ids(conn):
+        """subject_code -> subject id, for every subject."""
+        return {
+            _key(row['subject_code']): row['id']
+            for row in conn.execute('SELECT id, subject_code FROM subjects').fetchall()
+        }
+
+    @staticmethod
+    def _user_lookup(conn):
+        """username -> row with id, role and (for students) class_id."""
+        def fetch(usernames):
+            placeholders = ', '.join('?' * len(usernames))
+            rows = conn.execute(f'''
+                SELECT u.id, u.username, u.role, s.class_id
+                FROM users u
+                LEFT JOIN students s ON s.user_id = u.id
+                WHERE u.username IN ({placeholders})
+            ''', usernames).fetchall()
+            return {row['username']: row for row in rows}
+        return Lookup(fetch)
+
     @staticmethod
     def download_template(template_type):
         """
@@ -81,20 +218,17 @@ class ExcelImporter:
         return file_data, filename
 
     @staticmethod
-    def import_students(file_stream):
+    def import_students(file_stream, progress=None):
         """
         Imports students from an Excel file.
-        This function calls the Student.create_student model method,
-        which automatically creates the user account and student profile.
+        Each chunk of rows goes to Student.create_students_bulk, which
+        creates the user accounts, student profiles and enrollments in one
+        transaction per chunk.
         """
         conn = get_db_connection()
-        cursor = conn.cursor()
         
         try:
-            wb = openpyxl.load_workbook(file_stream)
-            ws = wb.active
-            
-            headers = [cell.value.lower().strip() for cell in ws[1]]
+            headers, chunks = ExcelImporter._read_chunks(file_stream)
             required_headers = [
                 'full_name', 'email', 'gender', 'date_of_birth', 
                 'class_name', 'section', 'roll_number', 
@@ -107,56 +241,70 @@ class ExcelImporter:
             
             added_count = 0
             failed_rows = []
+            class_ids = ExcelImporter._class_ids(conn)
             
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                data = dict(zip(headers, [cell.value for cell in row]))
-                
-                try:
-                    # 1. Find class_id from class_name and section
-                    class_name = data.get('class_name')
-                    section = data.get('section')
+            def prepare(chunk):
+                chunk_failures = []
+                pending = []
+                for row_idx, data in chunk:
+                    try:
+                        # 1. Find class_id from class_name and section
+                        class_name = data.get('class_name')
+                        section = data.get('section')
                     
-                    class_data = cursor.execute(
-                        "SELECT id FROM classes WHERE class_name = ? AND section = ?",
-                        (class_name, section)
-                    ).fetchone()
+                        class_id = class_ids.get((_key(class_name), _key(section)))
                     
-                    if not class_data:
-                        failed_rows.append(f"Row {row_idx}: Class '{class_name} - {section}' not found.")
-                        continue
-                        
-                    class_id = class_data['id']
+                        if not class_id:
+                            chunk_failures.append((row_idx, f"Row {row_idx}: Class '{class_name} - {section}' not found."))
+                            continue
                     
-                    # 2. Get all required data
-                    full_name = data.get('full_name')
-                    email = data.get('email')
-                    gender = data.get('gender')
-                    # Ensure DOB is a string in YYYY-MM-DD format
-                    date_of_birth_raw = data.get('date_of_birth')
-                    if isinstance(date_of_birth_raw, datetime.datetime):
-                         date_of_birth = date_of_birth_raw.strftime('%Y-%m-%d')
-                    else:
-                         date_of_birth = str(date_of_birth_raw).split(' ')[0]
+                        # 2. Get all required data
+                        full_name = data.get('full_name')
+                        email = data.get('email')
+                        gender = data.get('gender')
+                        # Ensure DOB is a string in YYYY-MM-DD format
+                        date_of_birth_raw = data.get('date_of_birth')
+                        if isinstance(date_of_birth_raw, datetime.datetime):
+                             date_of_birth = date_of_birth_raw.strftime('%Y-%m-%d')
+                        else:
+                             date_of_birth = str(date_of_birth_raw).split(' ')[0]
                          
-                    roll_number = int(data.get('roll_number'))
-                    fathers_name = data.get('fathers_name')
-                    mothers_name = data.get('mothers_name')
-                    mobile_number = str(data.get('mobile_number', ''))
-                    academic_year = data.get('academic_year')
-
-                    # 3. Call the create_student model function
-                    student_id, message = Student.create_student(
-                        full_name, gender, date_of_birth, class_id, roll_number,
-                        fathers_name, mobile_number, mothers_name, email, academic_year
-                    )
-                    
-                    if student_id:
-                        added_count += 1
-                    else:
-                        failed_rows.append(f"Row {row_idx} ({full_name}): {message}")
+                        roll_number = int(data.get('roll_number'))
+                        fathers_name = data.get('fathers_name')
+                        mothers_name = data.get('mothers_name')
+                        mobile_number = str(data.get('mobile_number', ''))
+                        academic_year = data.get('academic_year')
+
+                        pending.append((row_idx, (
+                            full_name, gender, date_of_birth, class_id, roll_number,
+                            fathers_name, mobile_number, mothers_name, email, academic_year
+                        )))
                         
-                except Exception as e:
-                    failed_rows.append(f"Row {row_idx}: Error processing - {str(e)}")
+                    except Exception as e:
+                        chunk_failures.append((row_idx, f"Row {row_idx}: Error processing - {str(e)}"))
+
+                # Start hashing this chunk's passwords in the process pool
+                hashes = hash_passwords(Student.initial_password(student[2]) for _, student in pending)
+                return chunk_failures, pending, hashes
+
+            # The next chunk is parsed and hashing while this one is written
+            for chunk_failures, pending, hashes in _one_ahead(prepare(chunk) for chunk in chunks):
+                # 3. Create the whole chunk in one transaction
+                if pending:
+                    outcomes = Student.create_students_bulk(
+                        [student for _, student in pending], hashes.result()
+                    )
+                    for (row_idx, student), (student_id, message) in zip(pending, outcomes):
+                        if student_id:
+                            added_count += 1
+                        else:
+                            chunk_failures.append((row_idx, f"Row {row_idx} ({student[0]}): {message}"))
+
+                chunk_failures.sort(key=lambda failure: failure[0])
+                failed_rows.extend(message for _, message in chunk_failures)
+
+                if progress:
+                    progress(added_count, failed_rows)
 
             conn.close()
             
@@ -171,40 +319,57 @@ class ExcelImporter:
             return False, f"An error occurred: {str(e)}"
 
     @staticmethod
-    def import_users(file_stream):
+    def import_users(file_stream, progress=None):
         """Imports Admin/Teacher users from an Excel file."""
         conn = get_db_connection()
         try:
-            wb = openpyxl.load_workbook(file_stream)
-            ws = wb.active
-            headers = [cell.value.lower().strip() for cell in ws[1]]
+            headers, chunks = ExcelImporter._read_chunks(file_stream)
             
             added_count = 0
             failed_rows = []
             
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                data = dict(zip(headers, [cell.value for cell in row]))
-                
-                username = data.get('username')
-                password = data.get('password')
-                role = data.get('role')
-                name = data.get('name')
-                email = data.get('email', '')
+            def prepare(chunk):
+                rows = []
+                for row_idx, data in chunk:
+                    username = data.get('username')
+                    password = data.get('password')
+                    role = data.get('role')
+                    name = data.get('name')
+                    email = data.get('email', '')
                 
-                if not (username and password and role and name):
-                    failed_rows.append(f"Row {row_idx}: Missing required data.")
-                    continue
-                
-                if role == 'student':
-                    failed_rows.append(f"Row {row_idx} ({username}): Cannot bulk-add students. Use 'Upload Students' form.")
-                    continue
+                    if not (username and password and role and name):
+                        rows.append((row_idx, f"Row {row_idx}: Missing required data.", None))
+                        continue
                 
-                user_id = User.create_user(username, str(password), role, name, email)
-                if user_id:
-                    added_count += 1
-                else:
-                    failed_rows.append(f"Row {row_idx} ({username}): Username already exists.")
-            
+                    if role == 'student':
+                        rows.append((row_idx, f"Row {row_idx} ({username}): Cannot bulk-add students. Use 'Upload Students' form.", None))
+                        continue
+
+                    rows.append((row_idx, None, (username, str(password), role, name, email)))
+
+                # Start hashing this chunk's passwords in the process pool
+                hashes = hash_passwords(user[1] for _, _, user in rows if user)
+                return rows, hashes
+
+            # The next chunk is parsed and hashing while this one is written
+            for rows, hashes in _one_ahead(prepare(chunk) for chunk in chunks):
+                hashed = iter(hashes.result())
+                for row_idx, error, user in rows:
+                    if error:
+                        failed_rows.append(error)
+                        continue
+
+                    username, password, role, name, email = user
+                    user_id = User.create_user(username, password, role, name, email,
+                                               hashed_password=next(hashed))
+                    if user_id:
+                        added_count += 1
+                    else:
+                        failed_rows.append(f"Row {row_idx} ({username}): Username already exists.")
+
+                if progress:
+                    progress(added_count, failed_rows)
+
             conn.close()
             message = f"Import complete. Successfully added {added_count} users."
             if failed_rows:
@@ -215,32 +380,32 @@ class ExcelImporter:
             return False, f"An error occurred: {str(e)}"
 
     @staticmethod
-    def import_subjects(file_stream):
+    def import_subjects(file_stream, progress=None):
         """Imports subjects from an Excel file."""
         conn = get_db_connection()
         try:
-            wb = openpyxl.load_workbook(file_stream)
-            ws = wb.active
-            headers = [cell.value.lower().strip() for cell in ws[1]]
+            headers, chunks = ExcelImporter._read_chunks(file_stream)
             
             added_count = 0
             failed_rows = []
             
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                data = dict(zip(headers, [cell.value for cell in row]))
-                
-                name = data.get('subject_name')
-                code = data.get('subject_code')
+            for chunk in chunks:
+                for row_idx, data in chunk:
+                    name = data.get('subject_name')
+                    code = data.get('subject_code')
                 
-                if not (name and code):
-                    failed_rows.append(f"Row {row_idx}: Missing name or code.")
-                    continue
+                    if not (name and code):
+                        failed_rows.append(f"Row {row_idx}: Missing name or code.")
+                        continue
                 
-                if not Subject.create_subject(name, code):
-                    failed_rows.append(f"Row {row_idx} ({name}): Subject name or code already exists.")
-                else:
-                    added_count += 1
-            
+                    if not Subject.create_subject(name, code):
+                        failed_rows.append(f"Row {row_idx} ({name}): Subject name or code already exists.")
+                    else:
+                        added_count += 1
+
+                if progress:
+                    progress(added_count, failed_rows)
+
             conn.close()
             message = f"Import complete. Successfully added {added_count} subjects."
             if failed_rows:
@@ -251,48 +416,49 @@ class ExcelImporter:
             return False, f"An error occurred: {str(e)}"
 
     @staticmethod
-    def import_classes(file_stream):
+    def import_classes(file_stream, progress=None):
         """Imports classes from an Excel file."""
         conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            wb = openpyxl.load_workbook(file_stream)
-            ws = wb.active
-            headers = [cell.value.lower().strip() for cell in ws[1]]
+            headers, chunks = ExcelImporter._read_chunks(file_stream)
             
             added_count = 0
             failed_rows = []
+            users = ExcelImporter._user_lookup(conn)
             
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                data = dict(zip(headers, [cell.value for cell in row]))
-                
-                class_name = data.get('class_name')
-                section = data.get('section')
-                teacher_username = data.get('teacher_username')
+            for chunk in chunks:
+                users.prefetch(data.get('teacher_username') for _, data in chunk)
+                for row_idx, data in chunk:
+                    class_name = data.get('class_name')
+                    section = data.get('section')
+                    teacher_username = data.get('teacher_username')
                 
-                if not (class_name and section):
-                    failed_rows.append(f"Row {row_idx}: Missing class_name or section.")
-                    continue
+                    if not (class_name and section):
+                        failed_rows.append(f"Row {row_idx}: Missing class_name or section.")
+                        continue
                 
-                # Find teacher_id from username
-                teacher_id = None
-                if teacher_username:
-                    teacher = User.get_by_username(teacher_username)
-                    if teacher and teacher.role == 'teacher':
-                        teacher_id = teacher.id
+                    # Find teacher_id from username
+                    teacher_id = None
+                    if teacher_username:
+                        teacher = users.get(teacher_username)
+                        if teacher and teacher['role'] == 'teacher':
+                            teacher_id = teacher['id']
+                        else:
+                            failed_rows.append(f"Row {row_idx}: Teacher '{teacher_username}' not found or is not a teacher.")
+                            continue
                     else:
-                        failed_rows.append(f"Row {row_idx}: Teacher '{teacher_username}' not found or is not a teacher.")
+                        failed_rows.append(f"Row {row_idx}: Missing teacher_username.")
                         continue
-                else:
-                    failed_rows.append(f"Row {row_idx}: Missing teacher_username.")
-                    continue
-
-                class_id, message = Class.create_class(class_name, section, teacher_id)
-                if class_id:
-                    added_count += 1
-                else:
-                    failed_rows.append(f"Row {row_idx} ({class_name}): {message}")
-            
+
+                    class_id, message = Class.create_class(class_name, section, teacher_id)
+                    if class_id:
+                        added_count += 1
+                    else:
+                        failed_rows.append(f"Row {row_idx} ({class_name}): {message}")
+
+                if progress:
+                    progress(added_count, failed_rows)
+
             conn.close()
             message = f"Import complete. Successfully added {added_count} classes."
             if failed_rows:
@@ -303,54 +469,79 @@ class ExcelImporter:
             return False, f"An error occurred: {str(e)}"
 
     @staticmethod
-    def import_results(file_stream):
-        """Imports results from an Excel file."""
+    def import_results(file_stream, teacher_id, role, progress=None):
+        """
+        Imports results from an Excel file. Each result is recorded against
+        the student's current class and entered by teacher_id (the uploader).
+        Unless role is 'admin', rows are limited to the subjects the
+        uploader teaches.
+        """
         conn = get_db_connection()
-        cursor = conn.cursor()
         try:
-            wb = openpyxl.load_workbook(file_stream)
-            ws = wb.active
-            headers = [cell.value.lower().strip() for cell in ws[1]]
+            headers, chunks = ExcelImporter._read_chunks(file_stream)
             
             added_count = 0
             failed_rows = []
+            users = ExcelImporter._user_lookup(conn)
+            subject_ids = ExcelImporter._subject_ids(conn)
+            if role == 'admin':
+                taught = None
+            else:
+                taught = {subject['id'] for subject in User.get_teacher_access(teacher_id)['subjects']}
             
-            for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-                data = dict(zip(headers, [cell.value for cell in row]))
-                
-                try:
-                    student_username = data.get('student_username')
-                    subject_code = data.get('subject_code')
-                    marks_obtained = float(data.get('marks_obtained'))
-                    total_marks = float(data.get('total_marks'))
-                    exam_type = data.get('exam_type')
-                    academic_year = data.get('academic_year')
+            for chunk in chunks:
+                users.prefetch(data.get('student_username') for _, data in chunk)
+                entries = []
+                entry_rows = []
+                for row_idx, data in chunk:
+                    try:
+                        student_username = data.get('student_username')
+                        subject_code = data.get('subject_code')
+                        marks_obtained = float(data.get('marks_obtained'))
+                        total_marks = float(data.get('total_marks'))
+                        exam_type = data.get('exam_type')
+                        academic_year = data.get('academic_year')
                     
-                    # Find student_id
-                    student = User.get_by_username(student_username)
-                    if not (student and student.role == 'student'):
-                        failed_rows.append(f"Row {row_idx}: Student user '{student_username}' not found.")
-                        continue
+                        # Find student_id
+                        student = users.get(student_username)
+                        if not (student and student['role'] == 'student'):
+                            failed_rows.append(f"Row {row_idx}: Student user '{student_username}' not found.")
+                            continue
+                        if student['class_id'] is None:
+                            failed_rows.append(f"Row {row_idx}: Student '{student_username}' has no class.")
+                            continue
                     
-                    # Find subject_id
-                    subject = cursor.execute("SELECT id FROM subjects WHERE subject_code = ?", (subject_code,)).fetchone()
-                    if not subject:
-                        failed_rows.append(f"Row {row_idx}: Subject code '{subject_code}' not found.")
-                        continue
+                        # Find subject_id
+                        subject_id = subject_ids.get(_key(subject_code))
+                        if not subject_id:
+                            failed_rows.append(f"Row {row_idx}: Subject code '{subject_code}' not found.")
+                            continue
+                        # The subject must also be taught in the student's
+                        # class, which enter_marks_bulk checks
+                        if taught is not None and subject_id not in taught:
+                            failed_rows.append(f"Row {row_idx}: you do not teach {subject_code}.")
+                            continue
                     
-                    result_id, message = Result.enter_marks(
-                        student.id, subject['id'], marks_obtained, 
-                        total_marks, exam_type, academic_year
-                    )
-                    
-                    if result_id:
+                        entries.append((
+                            student['id'], subject_id, student['class_id'], teacher_id,
+                            marks_obtained, total_marks, exam_type, academic_year
+                        ))
+                        entry_rows.append((row_idx, student_username))
+
+                    except Exception as e:
+                        failed_rows.append(f"Row {row_idx}: Error processing - {str(e)}")
+                
+                # One validation query and one commit per chunk
+                outcomes = Result.enter_marks_bulk(entries)
+                for (row_idx, student_username), (success, message) in zip(entry_rows, outcomes):
+                    if success:
                         added_count += 1
                     else:
                         failed_rows.append(f"Row {row_idx} ({student_username}): {message}")
 
-                except Exception as e:
-                    failed_rows.append(f"Row {row_idx}: Error processing - {str(e)}")
-            
+                if progress:
+                    progress(added_count, failed_rows)
+
             conn.close()
             message = f"Import complete. Successfully added {added_count} results."
             if failed_rows:
@@ -0,0 +1,273 @@
+"""
+Background Excel imports.
+
+Upload routes call submit(), which saves the file under
+UPLOAD_FOLDER/jobs, records a row in the jobs table and hands the import to
+an in-process thread pool, so the request returns a job id straight away.
+The importers report after every chunk; the job row keeps the running
+counts and the first ERROR_LIMIT row errors, so status() (served at
+/jobs/<id>) can report progress and rows per second to any request - a page
+reload simply asks again. events() streams the same progress as
+Server-Sent Events (/jobs/<id>/events) so pages don't have to poll.
+
+At startup recover() re-queues jobs that never started and marks jobs whose
+worker process is gone as failed. Imports are not idempotent, so a job that
+stopped half way is reported rather than replayed.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from database import get_db_connection
+from excel_utils import ExcelImporter
+from models import User
+
+# Row errors kept on the job record; the final message has all of them
+ERROR_LIMIT = 50
+
+# A running job that has not reported for this long is presumed dead
+STALE_SECONDS = 600
+
+
+def _uploader_role(job):
+    """The role of the user who queued job, or None if they are gone."""
+    user = User.get_by_id(job['created_by'])
+    return user.role if user else None
+
+
+IMPORTERS = {
+    'users': lambda stream, job, progress: ExcelImporter.import_users(stream, progress=progress),
+    'subjects': lambda stream, job, progress: ExcelImporter.import_subjects(stream, progress=progress),
+    'students': lambda stream, job, progress: ExcelImporter.import_students(stream, progress=progress),
+    'classes': lambda stream, job, progress: ExcelImporter.import_classes(stream, progress=progress),
+    'results': lambda stream, job, progress: ExcelImporter.import_results(
+        stream, job['created_by'], _uploader_role(job), progress=progress
+    ),
+}
+
+# Seconds between keep-alive comments on an idle event stream
+HEARTBEAT_SECONDS = 15
+
+PROGRESS_FIELDS = ['status', 'rows_total', 'rows_processed', 'rows_succeeded', 'rows_failed',
+                   'chunks_done', 'percent', 'rows_per_second', 'elapsed_seconds']
+
+_executor = None
+_upload_dir = None
+
+# Wakes event streams in this process when a job row changes; streams
+# also re-read the row every second, for jobs run by another process
+_changed = threading.Condition()
+
+
+def init_app(app):
+    """Start the job runner for app and pick up jobs left by a previous run."""
+    global _executor, _upload_dir
+    # SQLite has one writer at a time, so one import at a time by default
+    app.config.setdefault('JOB_WORKERS', 1)
+    _upload_dir = os.path.abspath(os.path.join(app.config.get('UPLOAD_FOLDER', 'uploads'), 'jobs'))
+    os.makedirs(_upload_dir, exist_ok=True)
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                   thread_name_prefix='import-job')
+    recover()
+
+
+def submit(kind, file_storage, user_id):
+    """Queue an import of an uploaded file; returns the new job id."""
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import type: {kind}")
+    job_id = uuid.uuid4().hex
+    extension = os.path.splitext(file_storage.filename or '')[1].lower() or '.xlsx'
+    file_path = os.path.join(_upload_dir, job_id + extension)
+    file_storage.save(file_path)
+
+    conn = get_db_connection()
+    conn.execute(
+        'INSERT INTO jobs (id, kind, created_by, filename, file_path, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (job_id, kind, user_id, file_storage.filename, file_path, time.time())
+    )
+    conn.commit()
+    conn.close()
+
+    _executor.submit(run, job_id)
+    return job_id
+
+
+def run(job_id):
+    """Run a queued job to completion (in a worker thread)."""
+    now = time.time()
+    conn = get_db_connection()
+    claimed = conn.execute(
+        "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, updated_at = ? "
+        "WHERE id = ? AND status = 'queued'",
+        (os.getpid(), now, now, job_id)
+    ).rowcount
+    conn.commit()
+    job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    # Another worker got there first
+    if not claimed:
+        return
+
+    chunks_done = 0
+    counts = [0, 0]
+
+    def progress(added_count, failed_rows):
+        nonlocal chunks_done
+        chunks_done += 1
+        counts[:] = [added_count, len(failed_rows)]
+        _update(job_id,
+                rows_processed=added_count + len(failed_rows),
+                rows_succeeded=added_count,
+                rows_failed=len(failed_rows),
+                chunks_done=chunks_done,
+                errors=json.dumps(failed_rows[:ERROR_LIMIT]))
+
+    try:
+        _update(job_id, rows_total=ExcelImporter.count_rows(job['file_path']))
+        with open(job['file_path'], 'rb') as stream:
+            success, message = IMPORTERS[job['kind']](stream, job, progress)
+    except Exception as e:
+        success, message = False, f"Error processing file: {str(e)}"
+
+    metrics.import_finished(job['kind'], counts[0], counts[1], time.time() - now)
+    _finish(job_id, 'succeeded' if success else 'failed', message)
+
+
+def _update(job_id, **fields):
+    fields['updated_at'] = time.time()
+    assignments = ', '.join(f'{column} = ?' for column in fields)
+    conn = get_db_connection()
+    conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+    _notify()
+
+
+def _finish(job_id, status, message):
+    conn = get_db_connection()
+    file_path = conn.execute('SELECT file_path FROM jobs WHERE id = ?', (job_id,)).fetchone()['file_path']
+    now = time.time()
+    conn.execute(
+        'UPDATE jobs SET status = ?, message = ?, file_path = NULL, updated_at = ?, finished_at = ? WHERE id = ?',
+        (status, message, now, now, job_id)
+    )
+    conn.commit()
+    conn.close()
+    _notify()
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def _notify():
+    with _changed:
+        _changed.notify_all()
+
+
+def _process_alive(pid):
+    if not pid or pid == os.getpid():
+        # recover() runs before this process starts any job
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover():
+    """Re-queue jobs that never started; fail those whose worker died."""
+    conn = get_db_connection()
+    jobs = conn.execute(
+        "SELECT id, status, file_path, worker_pid, rows_processed, updated_at "
+        "FROM jobs WHERE status IN ('queued', 'running')"
+    ).fetchall()
+    conn.close()
+
+    now = time.time()
+    for job in jobs:
+        if job['status'] == 'queued':
+            if job['file_path'] and os.path.exists(job['file_path']):
+                _executor.submit(run, job['id'])
+            else:
+                _finish(job['id'], 'failed', 'The uploaded file is no longer available. Please upload it again.')
+        elif not _process_alive(job['worker_pid']) or now - (job['updated_at'] or 0) > STALE_SECONDS:
+            _finish(job['id'], 'failed',
+                    f"Import interrupted by a server restart after {job['rows_processed']} rows. "
+                    f"Rows already processed were kept; upload the remaining rows again.")
+
+
+def status(job_id):
+    """The job as a dict with progress figures, or None if there is no such job."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return None
+
+    job = dict(row)
+    del job['file_path']
+    del job['worker_pid']
+    job['errors'] = json.loads(job['errors'] or '[]')
+    elapsed = None
+    if job['started_at']:
+        elapsed = (job['finished_at'] or time.time()) - job['started_at']
+    job['elapsed_seconds'] = round(elapsed, 2) if elapsed is not None else None
+    job['rows_per_second'] = round(job['rows_processed'] / elapsed, 1) if elapsed else 0
+    job['percent'] = (
+        min(100, round(job['rows_processed'] * 100 / job['rows_total']))
+        if job['rows_total'] else None
+    )
+    return job
+
+
+def _sse(event, data, event_id=None):
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def events(job_id, errors_sent=0):
+    """
+    Server-Sent Events for a job until it finishes: a "progress" event each
+    time a chunk completes, a "row_error" event for each of the first
+    ERROR_LIMIT row errors and a final "done" event with the full message.
+    Each row_error carries its position as the event id, so a reconnecting
+    client passes Last-Event-ID as errors_sent and gets only newer errors.
+    """
+    last = None
+    last_sent = time.time()
+    while True:
+        job = status(job_id)
+        if job is None:
+            yield _sse('done', {'status': 'failed', 'message': 'Job not found'})
+            return
+
+        snapshot = (job['status'], job['rows_processed'], job['chunks_done'])
+        if snapshot != last:
+            last = snapshot
+            yield _sse('progress', {field: job[field] for field in PROGRESS_FIELDS})
+            for error in job['errors'][errors_sent:]:
+                errors_sent += 1
+                yield _sse('row_error', {'message': error}, event_id=errors_sent)
+            last_sent = time.time()
+
+        if job['status'] in ('succeeded', 'failed'):
+            yield _sse('done', {'status': job['status'], 'message': job['message'],
+                                'rows_succeeded': job['rows_succeeded'],
+                                'rows_failed': job['rows_failed']})
+            return
+
+        with _changed:
+            _changed.wait(1.0)
+        if time.time() - last_sent >= HEARTBEAT_SECONDS:
+            last_sent = time.time()
+            yield ': keep-alive\n\n'
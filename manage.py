@@ -0,0 +1,163 @@
+"""
+Command line maintenance tasks for the school results database.
+
+    python manage.py db-settings [--profile concurrent]
+    python manage.py check-plans [-v]
+    python manage.py check-queries
+    python manage.py migrate
+    python manage.py rebuild-summaries [--verify-only]
+    python manage.py dedup-results [--dry-run] [--vacuum]
+"""
+import argparse
+import sys
+
+import database
+
+
+def cmd_db_settings(args):
+    if args.profile:
+        database.configure_pool(database.DATABASE, profile=args.profile)
+    report = database.settings_report()
+    print(f"Database: {report['database']}")
+    print(f"Profile:  {report['profile']}")
+    print(f"{'PRAGMA':<14}{'configured':>14}{'active':>14}")
+    for name, value in report['active'].items():
+        configured = report['configured'].get(name, '-')
+        print(f"{name:<14}{str(configured):>14}{str(value):>14}")
+
+
+def cmd_check_plans(args):
+    from query_plans import check_query_plans
+
+    failures = check_query_plans(verbose=args.verbose)
+    for label, sql, plan in failures:
+        print(f"FULL SCAN in {label}")
+        print(f"  {' '.join(sql.split())}")
+        for detail in plan:
+            print(f"    {detail}")
+    if failures:
+        print(f"{len(failures)} query plan(s) fall back to a full table scan")
+        return 1
+    print("All model queries use an index")
+    return 0
+
+
+def cmd_check_queries(args):
+    from query_counts import MANY_CLASSES, check_query_counts
+
+    failures = check_query_counts()
+    for label, small, large in failures:
+        print(f"{label}: {small} queries with 1 class, {large} with {MANY_CLASSES}")
+    if failures:
+        print(f"{len(failures)} route(s) run more queries as the data grows")
+        return 1
+    print("Query counts do not grow with the data")
+    return 0
+
+
+def cmd_migrate(args):
+    from migrations import current_version, latest_version, migrate
+
+    conn = database.get_db_connection()
+    try:
+        applied = migrate(conn)
+        version = current_version(conn)
+    finally:
+        conn.close()
+    for step in applied:
+        print(f"Applied migration {step}")
+    print(f"Schema is at version {version} (latest {latest_version()})")
+
+
+def cmd_rebuild_summaries(args):
+    import result_stats
+
+    conn = database.get_db_connection()
+    try:
+        if not args.verify_only:
+            conn.execute('BEGIN IMMEDIATE')
+            result_stats.rebuild(conn)
+            conn.commit()
+            print("Summary tables rebuilt from results")
+        problems = result_stats.verify(conn)
+    finally:
+        conn.close()
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} summary row(s) do not match the results table")
+        return 1
+    print("Summary tables match the results table")
+    return 0
+
+
+def cmd_dedup_results(args):
+    """
+    Delete duplicate results, keeping the latest row for each student,
+    subject, exam type and academic year. Migration 9 does the same before
+    adding the unique index; on a large database run this first to choose
+    when the cost is paid, and --vacuum to give the space back.
+    """
+    from migrations import delete_duplicate_results
+
+    conn = database.get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        deleted = delete_duplicate_results(conn)
+        if args.dry_run:
+            conn.rollback()
+            print(f"{deleted} duplicate result(s) would be deleted")
+            return 0
+        conn.commit()
+        print(f"Deleted {deleted} duplicate result(s)")
+        if args.vacuum:
+            before = _database_bytes(conn)
+            conn.execute('VACUUM')
+            print(f"Vacuumed: {before / 1e6:.1f} MB -> {_database_bytes(conn) / 1e6:.1f} MB")
+    finally:
+        conn.close()
+    return 0
+
+
+def _database_bytes(conn):
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="School results maintenance commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    settings = commands.add_parser('db-settings', help="show the SQLite tuning profile in effect")
+    settings.add_argument('--profile', choices=sorted(database.TUNING_PROFILES),
+                          help="apply this profile instead of the configured one")
+    settings.set_defaults(func=cmd_db_settings)
+
+    plans = commands.add_parser('check-plans', help="fail if a model query does a full table scan")
+    plans.add_argument('-v', '--verbose', action='store_true', help="print every query plan")
+    plans.set_defaults(func=cmd_check_plans)
+
+    counts = commands.add_parser('check-queries',
+                                 help="fail if a route's query count grows with the data")
+    counts.set_defaults(func=cmd_check_queries)
+
+    migrate = commands.add_parser('migrate', help="apply pending schema migrations")
+    migrate.set_defaults(func=cmd_migrate)
+
+    summaries = commands.add_parser('rebuild-summaries',
+                                    help="recompute the result_stats_* tables from results")
+    summaries.add_argument('--verify-only', action='store_true',
+                           help="only compare the summaries with the results table")
+    summaries.set_defaults(func=cmd_rebuild_summaries)
+
+    dedup = commands.add_parser('dedup-results',
+                                help="delete duplicate results, keeping the latest of each")
+    dedup.add_argument('--dry-run', action='store_true', help="only count the duplicates")
+    dedup.add_argument('--vacuum', action='store_true', help="compact the database file afterwards")
+    dedup.set_defaults(func=cmd_dedup_results)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
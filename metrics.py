@@ -0,0 +1,139 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+With a single process the metrics live in that process. Under gunicorn
+(or any server with several worker processes) set PROMETHEUS_MULTIPROC_DIR
+to an empty directory before the workers start: every process then
+records into memory-mapped files there and /metrics, whichever worker
+answers it, adds them all up. Clear the directory on each deploy, and
+have gunicorn drop the samples of workers that exit:
+
+    # gunicorn.conf.py
+    from metrics import child_exit
+
+Rates and ratios are left to the queries, e.g.
+
+    rate(school_cache_lookups_total{result="hit"}[5m])
+        / rate(school_cache_lookups_total[5m])
+    rate(school_import_rows_total[5m]) / rate(school_import_seconds_total[5m])
+    rate(school_db_lock_wait_seconds_total[5m])
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, multiprocess,
+)
+
+import database
+
+REQUEST_LATENCY = Histogram(
+    'school_http_request_duration_seconds', 'Request latency by Flask endpoint',
+    ['method', 'endpoint', 'status'],
+)
+SQL_STATEMENTS = Counter(
+    'school_sql_statements_total', 'SQL statements executed by requests', ['endpoint'],
+)
+SQL_SECONDS = Counter(
+    'school_sql_seconds_total', 'Time requests spent executing SQL', ['endpoint'],
+)
+SQL_REQUEST_SECONDS = Histogram(
+    'school_sql_request_duration_seconds', 'SQL time per request',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+POOL_IN_USE = Gauge(
+    'school_db_pool_connections_in_use', 'Pooled connections leased out', multiprocess_mode='livesum',
+)
+POOL_IDLE = Gauge(
+    'school_db_pool_connections_idle', 'Pooled connections waiting for reuse', multiprocess_mode='livesum',
+)
+CACHE_LOOKUPS = Counter(
+    'school_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    'school_password_hash_seconds', 'Time to hash one password',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5),
+)
+IMPORT_ROWS = Counter(
+    'school_import_rows_total', 'Excel import rows by entity type and outcome', ['kind', 'outcome'],
+)
+IMPORT_SECONDS = Counter(
+    'school_import_seconds_total', 'Time spent running Excel imports', ['kind'],
+)
+IMPORT_ROWS_PER_SECOND = Gauge(
+    'school_import_rows_per_second', 'Throughput of the latest finished import', ['kind'],
+    multiprocess_mode='mostrecent',
+)
+DB_BUSY_RETRIES = Counter(
+    'school_db_busy_retries_total', 'Transactions retried after finding the database locked', ['operation'],
+)
+DB_LOCK_WAIT_SECONDS = Counter(
+    'school_db_lock_wait_seconds_total', 'Time lost to a locked database: failed attempts plus backoff',
+    ['operation'],
+)
+DB_LOCK_ERRORS = Counter(
+    'school_db_lock_errors_total', 'Transactions still locked after every retry', ['operation'],
+)
+WRITE_BATCH_SIZE = Histogram(
+    'school_write_queue_batch_size', 'Writes committed together by the write queue',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+
+def cache_lookup(cache, hit, count=1):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc(count)
+
+
+def import_finished(kind, rows_succeeded, rows_failed, seconds):
+    IMPORT_ROWS.labels(kind, 'succeeded').inc(rows_succeeded)
+    IMPORT_ROWS.labels(kind, 'failed').inc(rows_failed)
+    IMPORT_SECONDS.labels(kind).inc(seconds)
+    if seconds > 0:
+        IMPORT_ROWS_PER_SECOND.labels(kind).set((rows_succeeded + rows_failed) / seconds)
+
+
+def child_exit(server, worker):
+    """gunicorn hook: forget the live gauges of a worker that has exited."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def render():
+    """All metrics in the text format, summed over worker processes if configured."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app):
+    @app.before_request
+    def start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(request.method, endpoint, response.status_code).observe(
+            time.perf_counter() - started
+        )
+        profile = g.get('_sql_profile')
+        if profile is not None:
+            SQL_STATEMENTS.labels(endpoint).inc(profile.count)
+            SQL_SECONDS.labels(endpoint).inc(profile.total_time)
+            SQL_REQUEST_SECONDS.observe(profile.total_time)
+        pool = database.get_pool()
+        POOL_IN_USE.set(pool.in_use)
+        POOL_IDLE.set(pool.idle)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE_LATEST)
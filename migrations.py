@@ -0,0 +1,673 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function registered with @migration(version, ...). The
+schema_version table records which ones have been applied, so startup on a
+current database is a single SELECT. Migrations run in version order, each
+in its own transaction unless it manages transactions itself (batched table
+rebuilds do).
+
+To change the schema, append a new migration - never edit an applied one.
+"""
+import os
+import sqlite3
+import time
+
+from werkzeug.security import generate_password_hash
+
+MIGRATIONS = []
+
+# A crashed migrator leaves its lock row behind; take it over after this long
+LOCK_TIMEOUT_SECONDS = 600
+
+
+def migration(version, description, transactional=True):
+    """Register a schema migration step."""
+    def register(func):
+        MIGRATIONS.append((version, description, transactional, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    try:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    return version or 0
+
+
+def _acquire_lock(conn):
+    """Make sure only one worker migrates at a time."""
+    while True:
+        try:
+            conn.execute(
+                'INSERT INTO schema_migration_lock (id, owner, acquired_at) VALUES (1, ?, ?)',
+                (os.getpid(), time.time())
+            )
+            conn.commit()
+            return
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            conn.execute(
+                'DELETE FROM schema_migration_lock WHERE acquired_at < ?',
+                (time.time() - LOCK_TIMEOUT_SECONDS,)
+            )
+            conn.commit()
+            time.sleep(0.2)
+
+
+def _release_lock(conn):
+    conn.rollback()
+    conn.execute('DELETE FROM schema_migration_lock WHERE id = 1')
+    conn.commit()
+
+
+def migrate(conn):
+    """
+    Bring the database up to the latest schema version.
+    Returns the list of versions that were applied (empty when current).
+    """
+    if current_version(conn) >= latest_version():
+        return []
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migration_lock (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner TEXT,
+            acquired_at REAL NOT NULL
+        )
+    ''')
+
+    applied = []
+    _acquire_lock(conn)
+    try:
+        # Another worker may have finished while we waited for the lock
+        current = current_version(conn)
+        for version, description, transactional, step in MIGRATIONS:
+            if version <= current:
+                continue
+            if transactional:
+                conn.execute('BEGIN IMMEDIATE')
+            step(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+    finally:
+        _release_lock(conn)
+    return applied
+
+
+#
+# Helpers for migration steps
+#
+
+def delete_duplicate_results(conn):
+    """
+    Keep only the latest row (by created_at, then id) for each student,
+    subject, exam type and academic year; returns the number deleted.
+    Rows without an exam type or academic year are left alone, as the
+    unique index on those columns does not cover them either.
+    """
+    return conn.execute('''
+        DELETE FROM results WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY student_id, subject_id, exam_type, academic_year
+                    ORDER BY created_at DESC, id DESC
+                ) AS newness
+                FROM results
+                WHERE exam_type IS NOT NULL AND academic_year IS NOT NULL
+            ) WHERE newness > 1
+        )
+    ''').rowcount
+
+
+def table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def column_names(conn, table):
+    # table_xinfo also lists generated columns
+    return [row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})').fetchall()]
+
+
+def add_column(conn, table, column_def):
+    """
+    ALTER TABLE ADD COLUMN unless the column is already there. Works for
+    VIRTUAL generated columns too; STORED ones need rebuild_table().
+    """
+    name = column_def.split()[0]
+    if name not in column_names(conn, table):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column_def}')
+
+
+def rebuild_table(conn, table, create_sql, batch_size=5000, pause=0.01):
+    """
+    Copy-and-swap `table` into a new definition on a live database.
+
+    create_sql is the new CREATE TABLE statement with '{table}' where the
+    name goes. Rows are copied in rowid order, batch_size per transaction,
+    pausing between batches so other writers get the lock; triggers mirror
+    any writes made to the old table meanwhile. The swap itself is one short
+    transaction, and the old table's indexes and triggers are recreated on
+    the new one. Columns missing from the new definition are dropped.
+    Must be called outside a transaction (register with transactional=False).
+    """
+    new = f'{table}__new'
+    old_columns = column_names(conn, table)
+    extras = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? "
+        "AND type IN ('index', 'trigger') AND sql IS NOT NULL AND name NOT LIKE ?",
+        (table, f'{new}%')
+    ).fetchall()]
+
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute(f'DROP TABLE IF EXISTS {new}')
+    conn.execute(create_sql.format(table=new))
+    columns = [c for c in column_names(conn, new) if c in old_columns]
+    col_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{c}' for c in columns)
+    conn.execute(f'''
+        CREATE TRIGGER {new}_ins AFTER INSERT ON {table} BEGIN
+            INSERT OR REPLACE INTO {new} ({col_list}) VALUES ({new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {new}_upd AFTER UPDATE ON {table} BEGIN
+            DELETE FROM {new} WHERE rowid = OLD.rowid;
+            INSERT OR REPLACE INTO {new} ({col_list}) VALUES ({new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {new}_del AFTER DELETE ON {table} BEGIN
+            DELETE FROM {new} WHERE rowid = OLD.rowid;
+        END
+    ''')
+    conn.commit()
+
+    last_rowid = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        upper = conn.execute(
+            f'SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?',
+            (last_rowid, batch_size - 1)
+        ).fetchone()
+        if upper is None:
+            # Last partial batch is copied inside the swap transaction
+            break
+        conn.execute(
+            f'INSERT OR IGNORE INTO {new} ({col_list}) '
+            f'SELECT {col_list} FROM {table} WHERE rowid > ? AND rowid <= ?',
+            (last_rowid, upper[0])
+        )
+        last_rowid = upper[0]
+        conn.commit()
+        time.sleep(pause)
+
+    conn.execute(
+        f'INSERT OR IGNORE INTO {new} ({col_list}) '
+        f'SELECT {col_list} FROM {table} WHERE rowid > ?',
+        (last_rowid,)
+    )
+    for suffix in ('ins', 'upd', 'del'):
+        conn.execute(f'DROP TRIGGER {new}_{suffix}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    for sql in extras:
+        conn.execute(sql)
+    conn.commit()
+
+
+#
+# Migrations
+#
+
+@migration(1, 'baseline schema')
+def baseline_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('admin', 'teacher', 'student')),
+            name TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(CLASSES_TABLE.format(table='classes').replace(
+        'CREATE TABLE', 'CREATE TABLE IF NOT EXISTS'))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject_name TEXT NOT NULL UNIQUE,
+            subject_code TEXT UNIQUE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS class_subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            class_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            is_compulsory BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (class_id) REFERENCES classes (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id),
+            UNIQUE(class_id, subject_id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS student_enrollment (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            class_id INTEGER NOT NULL,
+            academic_year TEXT,
+            FOREIGN KEY (student_id) REFERENCES users (id),
+            FOREIGN KEY (class_id) REFERENCES classes (id),
+            UNIQUE(student_id, class_id, academic_year)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            class_id INTEGER NOT NULL,
+            teacher_id INTEGER NOT NULL,
+            marks_obtained REAL NOT NULL,
+            total_marks REAL NOT NULL,
+            exam_type TEXT,
+            exam_date DATE DEFAULT CURRENT_DATE,
+            academic_year TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES users (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id),
+            FOREIGN KEY (class_id) REFERENCES classes (id),
+            FOREIGN KEY (teacher_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute(STUDENTS_TABLE.format(table='students').replace(
+        'CREATE TABLE', 'CREATE TABLE IF NOT EXISTS'))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS teacher_subject_assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            teacher_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            FOREIGN KEY (teacher_id) REFERENCES users (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id),
+            UNIQUE(teacher_id, subject_id)
+        )
+    ''')
+
+    # The only seed data: the admin account
+    hashed_password = generate_password_hash('admin123')
+    conn.execute('''
+        INSERT OR IGNORE INTO users (username, password, role, name, email)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ('admin', hashed_password, 'admin', 'System Administrator', 'admin@school.com'))
+
+
+CLASSES_TABLE = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        class_name TEXT NOT NULL,
+        section TEXT,
+        teacher_id INTEGER,
+        FOREIGN KEY (teacher_id) REFERENCES users (id),
+        UNIQUE(class_name, section)
+    )
+'''
+
+STUDENTS_TABLE = '''
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER UNIQUE NOT NULL,
+        student_id TEXT UNIQUE NOT NULL,
+        full_name TEXT NOT NULL,
+        gender TEXT NOT NULL CHECK(gender IN ('Male', 'Female', 'Other')),
+        date_of_birth DATE NOT NULL,
+        class_id INTEGER NOT NULL,
+        roll_number INTEGER NOT NULL,
+        fathers_name TEXT NOT NULL,
+        mobile_number TEXT,
+        mothers_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (class_id) REFERENCES classes (id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        UNIQUE(class_id, roll_number)
+    )
+'''
+
+
+@migration(2, 'reconcile schema created by the old reset_database.py', transactional=False)
+def reconcile_reset_schema(conn):
+    # reset_database.py used to create classes with UNIQUE(class_name), which
+    # stops two sections of the same class existing side by side
+    classes_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'classes'"
+    ).fetchone()[0]
+    if 'UNIQUE(class_name, section)' not in classes_sql:
+        rebuild_table(conn, 'classes', CLASSES_TABLE)
+
+    # ...and a students table without user_id. Student.create_student always
+    # failed against it, so any rows it has cannot be linked to a login.
+    if 'user_id' not in column_names(conn, 'students'):
+        rebuild_table(conn, 'students', STUDENTS_TABLE)
+
+
+@migration(3, 'indexes for the results hot paths')
+def results_indexes(conn):
+    # teacher_dashboard: count + latest results for a teacher
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_teacher_created ON results (teacher_id, created_at)')
+    # class_stats averages and per-subject breakdown read only this index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_class_subject '
+                 'ON results (class_id, subject_id, marks_obtained, total_marks)')
+    # results by subject for a teacher
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_subject_teacher ON results (subject_id, teacher_id)')
+    # a student's own results, newest first
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_student_created ON results (student_id, created_at)')
+    # admin "recent results" and the full results listing
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at)')
+    # class_subjects, student_enrollment and teacher_subject_assignments
+    # already have an index on the leading column of their UNIQUE constraint
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_student_enrollment_class ON student_enrollment (class_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_class_subjects_subject ON class_subjects (subject_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teacher_subjects_subject ON teacher_subject_assignments (subject_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_classes_teacher ON classes (teacher_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_role_name ON users (role, name)')
+
+
+def _result_stats_apply(row, sign):
+    """
+    Trigger statements that add (sign=1) or remove (sign=-1) one results row
+    (NEW or OLD) from the result_stats_* tables.
+    """
+    pct = f'({row}.marks_obtained * 100.0 / {row}.total_marks)'
+    graded = f'({pct} IS NOT NULL)'
+    value = f'IFNULL({pct}, 0)'
+    passed = f'IFNULL({pct} >= 50, 0)'
+    op = '+' if sign > 0 else '-'
+    totals = (f'result_count = result_count {op} 1, '
+              f'graded_count = graded_count {op} {graded}, '
+              f'percentage_sum = percentage_sum {op} {value}, '
+              f'pass_count = pass_count {op} {passed}')
+    exam_key = (f"IFNULL({row}.exam_type, '')", f"IFNULL({row}.academic_year, '')")
+
+    if sign > 0:
+        statements = [
+            f'''INSERT INTO result_stats_subject (subject_id) VALUES ({row}.subject_id)
+                ON CONFLICT (subject_id) DO NOTHING''',
+            f'''INSERT INTO result_stats_class (class_id) VALUES ({row}.class_id)
+                ON CONFLICT (class_id) DO NOTHING''',
+            f'''INSERT INTO result_stats_student (student_id) VALUES ({row}.student_id)
+                ON CONFLICT (student_id) DO NOTHING''',
+            f'''INSERT INTO result_stats_exam (exam_type, academic_year) VALUES ({exam_key[0]}, {exam_key[1]})
+                ON CONFLICT (exam_type, academic_year) DO NOTHING''',
+            f'''INSERT INTO result_stats_subject_student (subject_id, student_id, result_count)
+                VALUES ({row}.subject_id, {row}.student_id, 0)
+                ON CONFLICT (subject_id, student_id) DO NOTHING''',
+            f'''INSERT INTO result_stats_class_student (class_id, student_id, result_count)
+                VALUES ({row}.class_id, {row}.student_id, 0)
+                ON CONFLICT (class_id, student_id) DO NOTHING''',
+        ]
+        # a (subject, student) pair going 0 -> 1 is a new distinct student/subject
+        distinct_at = 1
+    else:
+        statements = []
+        distinct_at = 0
+
+    statements += [
+        f'UPDATE result_stats_subject SET {totals} WHERE subject_id = {row}.subject_id',
+        f'UPDATE result_stats_class SET {totals} WHERE class_id = {row}.class_id',
+        f'UPDATE result_stats_student SET {totals} WHERE student_id = {row}.student_id',
+        f'''UPDATE result_stats_exam SET {totals}
+            WHERE exam_type = {exam_key[0]} AND academic_year = {exam_key[1]}''',
+        f'''UPDATE result_stats_subject_student SET result_count = result_count {op} 1
+            WHERE subject_id = {row}.subject_id AND student_id = {row}.student_id''',
+        f'''UPDATE result_stats_class_student SET result_count = result_count {op} 1
+            WHERE class_id = {row}.class_id AND student_id = {row}.student_id''',
+        f'''UPDATE result_stats_subject SET student_count = student_count {op} 1
+            WHERE subject_id = {row}.subject_id AND (
+                SELECT result_count FROM result_stats_subject_student
+                WHERE subject_id = {row}.subject_id AND student_id = {row}.student_id) = {distinct_at}''',
+        f'''UPDATE result_stats_student SET subject_count = subject_count {op} 1
+            WHERE student_id = {row}.student_id AND (
+                SELECT result_count FROM result_stats_subject_student
+                WHERE subject_id = {row}.subject_id AND student_id = {row}.student_id) = {distinct_at}''',
+        f'''UPDATE result_stats_class SET student_count = student_count {op} 1
+            WHERE class_id = {row}.class_id AND (
+                SELECT result_count FROM result_stats_class_student
+                WHERE class_id = {row}.class_id AND student_id = {row}.student_id) = {distinct_at}''',
+    ]
+    if sign < 0:
+        statements += [
+            f'''DELETE FROM result_stats_subject_student WHERE result_count = 0
+                AND subject_id = {row}.subject_id AND student_id = {row}.student_id''',
+            f'''DELETE FROM result_stats_class_student WHERE result_count = 0
+                AND class_id = {row}.class_id AND student_id = {row}.student_id''',
+        ]
+    return ';\n'.join(statements) + ';'
+
+
+@migration(4, 'result summary tables maintained by triggers')
+def result_summary_tables(conn):
+    import result_stats
+
+    totals = '''
+        result_count INTEGER NOT NULL DEFAULT 0,
+        graded_count INTEGER NOT NULL DEFAULT 0,
+        percentage_sum REAL NOT NULL DEFAULT 0,
+        pass_count INTEGER NOT NULL DEFAULT 0,
+        average_percentage REAL GENERATED ALWAYS AS
+            (CASE WHEN graded_count > 0 THEN percentage_sum / graded_count END) VIRTUAL
+    '''
+    conn.execute(f'''
+        CREATE TABLE result_stats_subject (
+            subject_id INTEGER PRIMARY KEY,
+            {totals},
+            student_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE result_stats_class (
+            class_id INTEGER PRIMARY KEY,
+            {totals},
+            student_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE result_stats_student (
+            student_id INTEGER PRIMARY KEY,
+            {totals},
+            subject_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE result_stats_exam (
+            exam_type TEXT NOT NULL,
+            academic_year TEXT NOT NULL,
+            {totals},
+            PRIMARY KEY (exam_type, academic_year)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE result_stats_subject_student (
+            subject_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            result_count INTEGER NOT NULL,
+            PRIMARY KEY (subject_id, student_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE result_stats_class_student (
+            class_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            result_count INTEGER NOT NULL,
+            PRIMARY KEY (class_id, student_id)
+        ) WITHOUT ROWID
+    ''')
+    # top performers: best averages among students with 3+ subjects
+    conn.execute('CREATE INDEX idx_result_stats_student_average '
+                 'ON result_stats_student (average_percentage)')
+    # topper score: MAX(percentage) straight from an index
+    conn.execute('CREATE INDEX idx_results_percentage '
+                 'ON results ((marks_obtained * 100.0 / total_marks))')
+
+    conn.execute(f'''
+        CREATE TRIGGER results_stats_insert AFTER INSERT ON results BEGIN
+            {_result_stats_apply('NEW', 1)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER results_stats_delete AFTER DELETE ON results BEGIN
+            {_result_stats_apply('OLD', -1)}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER results_stats_update
+        AFTER UPDATE OF student_id, subject_id, class_id, marks_obtained, total_marks,
+                        exam_type, academic_year ON results
+        BEGIN
+            {_result_stats_apply('OLD', -1)}
+            {_result_stats_apply('NEW', 1)}
+        END
+    ''')
+
+    result_stats.rebuild(conn)
+
+
+@migration(5, 'background import jobs')
+def import_jobs(conn):
+    # Times are unix seconds (REAL) so progress rates can be computed exactly
+    conn.execute('''
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+            created_by INTEGER NOT NULL,
+            filename TEXT,
+            file_path TEXT,
+            worker_pid INTEGER,
+            rows_total INTEGER,
+            rows_processed INTEGER NOT NULL DEFAULT 0,
+            rows_succeeded INTEGER NOT NULL DEFAULT 0,
+            rows_failed INTEGER NOT NULL DEFAULT 0,
+            errors TEXT,
+            message TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            updated_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    ''')
+    # a user's recent jobs, and the queued/running jobs to recover at startup
+    conn.execute('CREATE INDEX idx_jobs_created_by ON jobs (created_by, created_at)')
+    conn.execute('CREATE INDEX idx_jobs_status ON jobs (status)')
+
+
+@migration(6, 'chunk counter for import progress events')
+def import_jobs_chunks(conn):
+    add_column(conn, 'jobs', 'chunks_done INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(7, 'indexes for paginated, filtered results listings')
+def results_listing_indexes(conn):
+    # Each filter on the results listing walks its own index in
+    # (created_at, id) order, so a page never sorts the matching rows
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_class_created ON results (class_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_subject_created ON results (subject_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_exam_created ON results (exam_type, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_results_year_created ON results (academic_year, created_at)')
+
+
+# trigram tokenizer: SQLite 3.34+
+TRIGRAM_SUPPORTED = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+@migration(8, 'full-text index for student search')
+def student_search_index(conn):
+    # Word-prefix matches ("ra" -> "Rahul Sharma"), for search-as-you-type
+    conn.execute('''
+        CREATE VIRTUAL TABLE student_search_prefix USING fts5(
+            full_name, username, fathers_name, student_id,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+        )
+    ''')
+    tables = ['student_search_prefix']
+    # Substring matches anywhere in a value ("arm" -> "Sharma")
+    if TRIGRAM_SUPPORTED:
+        conn.execute('''
+            CREATE VIRTUAL TABLE student_search_trigram USING fts5(
+                full_name, username, fathers_name, student_id,
+                tokenize = 'trigram'
+            )
+        ''')
+        tables.append('student_search_trigram')
+
+    # Rows are keyed by students.id; triggers keep them in step with
+    # students and with the username on users
+    for table in tables:
+        insert_row = f'''
+            INSERT INTO {table} (rowid, full_name, username, fathers_name, student_id)
+            SELECT NEW.id, NEW.full_name, u.username, NEW.fathers_name, NEW.student_id
+            FROM users u WHERE u.id = NEW.user_id;
+        '''
+        conn.execute(f'''
+            CREATE TRIGGER {table}_insert AFTER INSERT ON students BEGIN
+                {insert_row}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER {table}_update
+            AFTER UPDATE OF full_name, fathers_name, student_id, user_id ON students
+            BEGIN
+                DELETE FROM {table} WHERE rowid = OLD.id;
+                {insert_row}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER {table}_delete AFTER DELETE ON students BEGIN
+                DELETE FROM {table} WHERE rowid = OLD.id;
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER {table}_username AFTER UPDATE OF username ON users BEGIN
+                UPDATE {table} SET username = NEW.username
+                WHERE rowid = (SELECT id FROM students WHERE user_id = NEW.id);
+            END
+        ''')
+        conn.execute(f'''
+            INSERT INTO {table} (rowid, full_name, username, fathers_name, student_id)
+            SELECT s.id, s.full_name, u.username, s.fathers_name, s.student_id
+            FROM students s JOIN users u ON s.user_id = u.id
+        ''')
+
+
+@migration(9, 'one result per student, subject, exam type and academic year')
+def unique_results(conn):
+    # Resubmitted marks used to pile up as extra rows; the summary triggers
+    # take the deleted ones back out of result_stats_*
+    delete_duplicate_results(conn)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_results_student_exam '
+                 'ON results (student_id, subject_id, exam_type, academic_year)')
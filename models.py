@@ -1,4 +1,7 @@
-from database import get_db_connection
+from database import get_db_connection, retry_on_busy
+import cache_versions
+import write_queue
+from pagination import PAGE_SIZE, decode_cursor, fetch_page
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import random
@@ -7,6 +10,7 @@ import datetime
 
 class Enrollment:
     @staticmethod
+    @retry_on_busy
     def enroll_student(student_id, class_id, academic_year):
         # student_id is users.id
         conn = get_db_connection()
@@ -25,6 +29,7 @@ class Enrollment:
             return None
             
     @staticmethod
+    @retry_on_busy
     def update_student_enrollment(student_id, class_id, academic_year):
         # student_id is users.id
         conn = get_db_connection()
@@ -118,9 +123,12 @@ class User:
         return check_password_hash(self.password, password)
     
     @staticmethod
-    def create_user(username, password, role, name, email):
+    @retry_on_busy
+    def create_user(username, password, role, name, email, hashed_password=None):
         conn = get_db_connection()
-        hashed_password = generate_password_hash(password)
+        # Bulk imports pass a hash computed ahead of time in the hashing pool
+        if hashed_password is None:
+            hashed_password = generate_password_hash(password)
         try:
             cursor = conn.cursor()
             cursor.execute(
@@ -136,6 +144,7 @@ class User:
             return None
     
     @staticmethod
+    @retry_on_busy
     def update_user(user_id, username, role, name, email, password=None):
         conn = get_db_connection()
         try:
@@ -154,12 +163,14 @@ class User:
                 )
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.user_identity(user_id))
             return True
         except sqlite3.IntegrityError:
             conn.close()
             return False
     
     @staticmethod
+    @retry_on_busy
     def delete_user(user_id):
         conn = get_db_connection()
         try:
@@ -195,6 +206,9 @@ class User:
             cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.user_identity(user_id))
+            if user['role'] == 'teacher':
+                cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True, "User deleted successfully"
         except Exception as e:
             conn.rollback()
@@ -224,6 +238,38 @@ class User:
         conn.close()
         return users
     
+    @staticmethod
+    def get_users_page(after=None, limit=PAGE_SIZE, role=None):
+        """
+        One page of get_all_users_with_details, ordered by (role, name, id).
+        after is the cursor returned with the previous page. Returns
+        (users, next_cursor).
+        """
+        where, params = [], []
+        if role:
+            where.append('u.role = ?')
+            params.append(role)
+        key = decode_cursor(after, 3)
+        if key:
+            where.append('(u.role, u.name, u.id) > (?, ?, ?)')
+            params.extend(key)
+
+        conn = get_db_connection()
+        users, next_cursor = fetch_page(conn, f'''
+            SELECT 
+                u.id, u.username, u.name, u.email, u.role, u.created_at,
+                s.roll_number,
+                c.class_name, c.section
+            FROM users u
+            LEFT JOIN students s ON u.id = s.user_id
+            LEFT JOIN classes c ON s.class_id = c.id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY u.role, u.name, u.id
+            LIMIT ?
+        ''', params, limit, lambda row: (row['role'], row['name'], row['id']))
+        conn.close()
+        return users, next_cursor
+    
     @staticmethod
     def get_students():
         conn = get_db_connection()
@@ -255,6 +301,30 @@ class User:
         conn.close()
         return subjects
 
+    @staticmethod
+    def get_teacher_access(teacher_id):
+        """
+        The subjects a teacher is assigned and the ids of the classes taking
+        any of them, as plain lists so they can be kept in the session.
+        """
+        conn = get_db_connection()
+        subjects = conn.execute('''
+            SELECT s.id, s.subject_name, s.subject_code FROM subjects s
+            JOIN teacher_subject_assignments tsa ON s.id = tsa.subject_id
+            WHERE tsa.teacher_id = ?
+            ORDER BY s.subject_name
+        ''', (teacher_id,)).fetchall()
+        class_ids = conn.execute('''
+            SELECT DISTINCT cs.class_id FROM class_subjects cs
+            JOIN teacher_subject_assignments tsa ON cs.subject_id = tsa.subject_id
+            WHERE tsa.teacher_id = ?
+        ''', (teacher_id,)).fetchall()
+        conn.close()
+        return {
+            'subjects': [dict(subject) for subject in subjects],
+            'class_ids': [row['class_id'] for row in class_ids],
+        }
+
     @staticmethod
     def get_teachable_subjects_for_class(teacher_id, class_id):
         """
@@ -288,6 +358,7 @@ class User:
 
 class Student:
     @staticmethod
+    @retry_on_busy
     def create_student(full_name, gender, date_of_birth, class_id, roll_number, 
                       fathers_name, mobile_number, mothers_name, email, academic_year):
         
@@ -295,8 +366,7 @@ class Student:
         cursor = conn.cursor()
         
         try:
-            username = f"{full_name.split(' ')[0].lower().strip()}{roll_number}"
-            password = str(date_of_birth).replace('-', '')
+            username, password = Student.credentials(full_name, roll_number, date_of_birth)
         except Exception as e:
             return None, f"Error generating username/password: {str(e)}"
 
@@ -340,21 +410,140 @@ class Student:
         except sqlite3.IntegrityError as e:
             conn.rollback()
             conn.close()
-            if 'UNIQUE constraint failed: users.username' in str(e):
-                return None, f"Username '{username}' already exists. Student not created."
-            if 'UNIQUE constraint failed: users.email' in str(e):
-                return None, f"Email '{email}' already exists. Student not created."
-            elif 'UNIQUE constraint failed: students.class_id, students.roll_number' in str(e):
-                return None, "Roll number already exists in this class. Student not created."
-            elif 'UNIQUE constraint failed: students.user_id' in str(e):
-                return None, "This user already has a student profile. Student not created."
-            else:
-                return None, f"Database error: {str(e)}"
+            return None, Student._integrity_message(e, username, email)
         except Exception as e:
             conn.rollback()
             conn.close()
             return None, f"An unexpected error occurred: {str(e)}"
 
+    @staticmethod
+    def _integrity_message(error, username, email):
+        if 'UNIQUE constraint failed: users.username' in str(error):
+            return f"Username '{username}' already exists. Student not created."
+        if 'UNIQUE constraint failed: users.email' in str(error):
+            return f"Email '{email}' already exists. Student not created."
+        elif 'UNIQUE constraint failed: students.class_id, students.roll_number' in str(error):
+            return "Roll number already exists in this class. Student not created."
+        elif 'UNIQUE constraint failed: students.user_id' in str(error):
+            return "This user already has a student profile. Student not created."
+        else:
+            return f"Database error: {str(error)}"
+
+    @staticmethod
+    def credentials(full_name, roll_number, date_of_birth):
+        """The (username, password) create_student gives a new student."""
+        username = f"{full_name.split(' ')[0].lower().strip()}{roll_number}"
+        return username, Student.initial_password(date_of_birth)
+
+    @staticmethod
+    def initial_password(date_of_birth):
+        """A new student's password: their date of birth without dashes."""
+        return str(date_of_birth).replace('-', '')
+
+    @staticmethod
+    @retry_on_busy
+    def create_students_bulk(students, hashed_passwords=None):
+        """
+        Create many students (user account, profile and enrollment) in one
+        transaction.
+
+        students is a list of tuples in create_student's argument order.
+        hashed_passwords, if given, holds a precomputed hash of each
+        student's password (see password_hashing); otherwise they are hashed
+        here. Returns a (student_db_id, message) tuple per entry, with the
+        same messages create_student gives. The whole batch is first tried
+        with executemany; if any row breaks a constraint the batch is
+        replayed row by row inside savepoints, so only the bad rows are
+        rejected.
+        """
+        outcomes = [None] * len(students)
+        pending = []
+        for index, student in enumerate(students):
+            full_name, date_of_birth, roll_number = student[0], student[2], student[4]
+            try:
+                username, password = Student.credentials(full_name, roll_number, date_of_birth)
+            except Exception as e:
+                outcomes[index] = (None, f"Error generating username/password: {str(e)}")
+                continue
+            if hashed_passwords is not None:
+                hashed_password = hashed_passwords[index]
+            else:
+                hashed_password = generate_password_hash(password)
+            pending.append((index, username, password, hashed_password, student))
+
+        if not pending:
+            return outcomes
+
+        conn = get_db_connection()
+        try:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            conn.execute('SAVEPOINT bulk_students')
+            try:
+                created = Student._insert_students_batch(conn, pending)
+                conn.execute('RELEASE bulk_students')
+            except sqlite3.IntegrityError:
+                conn.execute('ROLLBACK TO bulk_students')
+                conn.execute('RELEASE bulk_students')
+                created = {}
+                for item in pending:
+                    index, username, _, _, student = item
+                    conn.execute('SAVEPOINT bulk_student_row')
+                    try:
+                        created.update(Student._insert_students_batch(conn, [item]))
+                        conn.execute('RELEASE bulk_student_row')
+                    except sqlite3.IntegrityError as e:
+                        conn.execute('ROLLBACK TO bulk_student_row')
+                        conn.execute('RELEASE bulk_student_row')
+                        outcomes[index] = (None, Student._integrity_message(e, username, student[8]))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            conn.rollback()
+            conn.close()
+            return [outcome or (None, f"An unexpected error occurred: {str(e)}") for outcome in outcomes]
+
+        for index, username, password, _, _ in pending:
+            if index in created:
+                outcomes[index] = (created[index], (f"Student created successfully! "
+                                                    f"Username: {username}, "
+                                                    f"Password: {password}"))
+        return outcomes
+
+    @staticmethod
+    def _insert_students_batch(conn, pending):
+        """Insert users, profiles and enrollments with executemany; returns {index: students.id}."""
+        conn.executemany(
+            'INSERT INTO users (username, password, role, name, email) VALUES (?, ?, ?, ?, ?)',
+            [(username, hashed, 'student', student[0], student[8])
+             for _, username, _, hashed, student in pending]
+        )
+        usernames = [username for _, username, _, _, _ in pending]
+        placeholders = ', '.join('?' * len(usernames))
+        user_ids = dict(conn.execute(
+            f'SELECT username, id FROM users WHERE username IN ({placeholders})', usernames
+        ).fetchall())
+
+        conn.executemany('''
+            INSERT INTO students 
+            (user_id, student_id, full_name, gender, date_of_birth, class_id, roll_number, 
+             fathers_name, mobile_number, mothers_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(user_ids[username], f"S{user_ids[username]:04d}", student[0], student[1], student[2],
+               student[3], student[4], student[5], student[6], student[7])
+              for _, username, _, _, student in pending])
+
+        conn.executemany('''
+            INSERT INTO student_enrollment (student_id, class_id, academic_year)
+            VALUES (?, ?, ?)
+        ''', [(user_ids[username], student[3], student[9]) for _, username, _, _, student in pending])
+
+        user_id_list = list(user_ids.values())
+        student_ids = dict(conn.execute(
+            f'SELECT user_id, id FROM students WHERE user_id IN ({placeholders})', user_id_list
+        ).fetchall())
+        return {index: student_ids[user_ids[username]] for index, username, _, _, _ in pending}
+
     
     @staticmethod
     def get_all_students():
@@ -369,6 +558,44 @@ class Student:
         conn.close()
         return students
     
+    @staticmethod
+    def get_students_page(after=None, limit=PAGE_SIZE, class_id=None, academic_year=None):
+        """
+        One page of get_all_students, ordered by class name, section and
+        roll number. after is the cursor returned with the previous page.
+        Returns (students, next_cursor).
+        """
+        where, params = [], []
+        if class_id:
+            where.append('s.class_id = ?')
+            params.append(class_id)
+        if academic_year:
+            where.append('''EXISTS (SELECT 1 FROM student_enrollment e
+                                  WHERE e.student_id = s.user_id AND e.academic_year = ?)''')
+            params.append(academic_year)
+        key = decode_cursor(after, 3)
+        if key:
+            # The first condition lets the classes index start at the
+            # cursor's class; the second skips what was already shown there.
+            # CROSS JOIN keeps classes as the outer loop (SQLite does not
+            # reorder it), so pages walk classes in order without a full sort.
+            where.append('(c.class_name, c.section) >= (?, ?)')
+            where.append('(c.class_name, c.section, s.roll_number) > (?, ?, ?)')
+            params.extend(key[:2] + key)
+
+        conn = get_db_connection()
+        students, next_cursor = fetch_page(conn, f'''
+            SELECT s.*, c.class_name, c.section, u.username, u.email
+            FROM classes c
+            CROSS JOIN students s ON s.class_id = c.id
+            JOIN users u ON s.user_id = u.id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY c.class_name, c.section, s.roll_number
+            LIMIT ?
+        ''', params, limit, lambda row: (row['class_name'], row['section'], row['roll_number']))
+        conn.close()
+        return students, next_cursor
+    
     @staticmethod
     def get_student_by_id(student_id):
         conn = get_db_connection()
@@ -395,6 +622,7 @@ class Student:
         return student
     
     @staticmethod
+    @retry_on_busy
     def update_student(student_id, full_name, gender, date_of_birth, class_id, 
                       roll_number, fathers_name, mobile_number, mothers_name, email):
         conn = get_db_connection()
@@ -427,6 +655,7 @@ class Student:
 
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.user_identity(user_id))
             return True, "Student updated successfully"
             
         except sqlite3.IntegrityError as e:
@@ -444,6 +673,7 @@ class Student:
             return False, f"An unexpected error occurred: {str(e)}"
     
     @staticmethod
+    @retry_on_busy
     def delete_student(student_id):
         conn = get_db_connection()
         try:
@@ -465,21 +695,84 @@ class Student:
 
     
     @staticmethod
-    def search_students(query):
+    def search_students(query, limit=50):
+        """
+        Students whose name, username, father's name or student ID match
+        query, best matches first, at most limit rows.
+
+        Uses the full-text indexes from migration 8: words starting with
+        the query's words rank first, then (for 3+ characters) values that
+        contain the query anywhere. One- and two-character queries are
+        returned in index order rather than ranked, and longer ones rank
+        only the first few hundred matches, so search-as-you-type stays
+        cheap however many students match.
+        """
+        query = (query or '').strip()
+        if not query:
+            return Student.get_students_page(limit=limit)[0]
+
+        candidates = max(limit * 10, 500)
         conn = get_db_connection()
-        students = conn.execute('''
+        prefix_match = ' '.join('"' + word.replace('"', '""') + '"*' for word in query.split())
+        if len(query) >= 3:
+            ids = [row[0] for row in conn.execute('''
+                SELECT rowid FROM (
+                    SELECT rowid, rank FROM student_search_prefix
+                    WHERE student_search_prefix MATCH ? LIMIT ?
+                ) ORDER BY rank LIMIT ?
+            ''', (prefix_match, candidates, limit)).fetchall()]
+        else:
+            ids = [row[0] for row in conn.execute(
+                'SELECT rowid FROM student_search_prefix WHERE student_search_prefix MATCH ? LIMIT ?',
+                (prefix_match, limit)
+            ).fetchall()]
+
+        if len(ids) < limit and len(query) >= 3:
+            has_trigram = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'student_search_trigram'"
+            ).fetchone()
+            if has_trigram:
+                substring_ids = conn.execute('''
+                    SELECT rowid FROM (
+                        SELECT rowid, rank FROM student_search_trigram
+                        WHERE student_search_trigram MATCH ? LIMIT ?
+                    ) ORDER BY rank LIMIT ?
+                ''', ('"' + query.replace('"', '""') + '"', candidates, limit + len(ids))).fetchall()
+            else:
+                # SQLite older than 3.34 has no trigram tokenizer
+                pattern = f'%{query}%'
+                substring_ids = conn.execute('''
+                    SELECT s.id FROM students s JOIN users u ON s.user_id = u.id
+                    WHERE s.full_name LIKE ? OR u.username LIKE ? OR s.fathers_name LIKE ? OR s.student_id LIKE ?
+                    LIMIT ?
+                ''', (pattern, pattern, pattern, pattern, limit + len(ids))).fetchall()
+            seen = set(ids)
+            for (student_id,) in substring_ids:
+                if len(ids) >= limit:
+                    break
+                if student_id not in seen:
+                    seen.add(student_id)
+                    ids.append(student_id)
+
+        if not ids:
+            conn.close()
+            return []
+
+        placeholders = ', '.join('?' * len(ids))
+        students = conn.execute(f'''
             SELECT s.*, c.class_name, c.section, u.username
             FROM students s 
             JOIN classes c ON s.class_id = c.id
             JOIN users u ON s.user_id = u.id
-            WHERE s.full_name LIKE ? OR u.username LIKE ? OR s.fathers_name LIKE ? OR s.student_id LIKE ?
-            ORDER BY c.class_name, s.roll_number
-        ''', (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%')).fetchall()
+            WHERE s.id IN ({placeholders})
+        ''', ids).fetchall()
         conn.close()
-        return students
+        by_id = {student['id']: student for student in students}
+        return [by_id[student_id] for student_id in ids if student_id in by_id]
 
 class Class:
     @staticmethod
+    @retry_on_busy
     def create_class(class_name, section, teacher_id):
         if not class_name or not section:
             return None, "Class name and section are required"
@@ -515,6 +808,7 @@ class Class:
             return None, f"Error creating class: {str(e)}"
     
     @staticmethod
+    @retry_on_busy
     def update_class(class_id, class_name, section, teacher_id):
         if not class_name or not section:
             return False, "Class name and section are required"
@@ -554,6 +848,7 @@ class Class:
             return False, f"Error updating class: {str(e)}"
     
     @staticmethod
+    @retry_on_busy
     def delete_class(class_id):
         conn = get_db_connection()
         try:
@@ -581,6 +876,7 @@ class Class:
                 
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True, "Class deleted successfully"
         except Exception as e:
             conn.rollback()
@@ -656,6 +952,7 @@ class Class:
             return []
     
     @staticmethod
+    @retry_on_busy
     def add_subject_to_class(class_id, subject_id, is_compulsory=True):
         conn = get_db_connection()
         try:
@@ -666,6 +963,7 @@ class Class:
             ''', (class_id, subject_id, is_compulsory))
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True, "Subject added to class successfully"
         except sqlite3.IntegrityError as e:
             conn.close()
@@ -675,6 +973,7 @@ class Class:
             return False, f"Error adding subject to class: {str(e)}"
     
     @staticmethod
+    @retry_on_busy
     def remove_subject_from_class(class_id, subject_id):
         conn = get_db_connection()
         try:
@@ -699,6 +998,7 @@ class Class:
                 
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True, "Subject removed from class successfully"
         except Exception as e:
             conn.close()
@@ -734,9 +1034,46 @@ class Class:
         ''', (subject_id,)).fetchall()
         conn.close()
         return classes
+
+    @staticmethod
+    def get_rosters_for_subject(subject_id):
+        """
+        Every class that has a subject, with its enrolled students, in one
+        query: a list of {'id', 'name', 'section', 'students'} ordered by
+        class and section, students by roll number. Classes with no
+        students are left out. The CROSS JOINs keep the subject's classes
+        as the outer loop, so the cost follows the size of the roster
+        rather than the number of students in the school.
+        """
+        conn = get_db_connection()
+        rows = conn.execute('''
+            SELECT c.id AS class_id, c.class_name, c.section,
+                   u.id, u.name, s.roll_number
+            FROM class_subjects cs
+            CROSS JOIN classes c ON c.id = cs.class_id
+            CROSS JOIN student_enrollment se ON se.class_id = c.id
+            JOIN users u ON u.id = se.student_id
+            JOIN students s ON s.user_id = u.id
+            WHERE cs.subject_id = ? AND u.role = 'student'
+            ORDER BY c.class_name, c.section, c.id, s.roll_number, u.name
+        ''', (subject_id,)).fetchall()
+        conn.close()
+
+        rosters = []
+        for row in rows:
+            if not rosters or rosters[-1]['id'] != row['class_id']:
+                rosters.append({
+                    'id': row['class_id'],
+                    'name': row['class_name'],
+                    'section': row['section'],
+                    'students': []
+                })
+            rosters[-1]['students'].append(row)
+        return rosters
             
 class Subject:
     @staticmethod
+    @retry_on_busy
     def create_subject(subject_name, subject_code):
         conn = get_db_connection()
         try:
@@ -754,6 +1091,7 @@ class Subject:
             return None
     
     @staticmethod
+    @retry_on_busy
     def update_subject(subject_id, subject_name, subject_code):
         conn = get_db_connection()
         try:
@@ -764,12 +1102,14 @@ class Subject:
             )
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True
         except sqlite3.IntegrityError:
             conn.close()
             return False
     
     @staticmethod
+    @retry_on_busy
     def delete_subject(subject_id):
         conn = get_db_connection()
         try:
@@ -792,6 +1132,7 @@ class Subject:
             cursor.execute('DELETE FROM subjects WHERE id = ?', (subject_id,))
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True, "Subject deleted successfully"
         except Exception as e:
             conn.close()
@@ -814,6 +1155,7 @@ class Subject:
         return subject
 
     @staticmethod
+    @retry_on_busy
     def assign_teacher_to_subject(subject_id, teacher_id):
         """Assigns a teacher to a subject."""
         conn = get_db_connection()
@@ -824,12 +1166,14 @@ class Subject:
             )
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True
         except Exception as e:
             conn.close()
             return False
 
     @staticmethod
+    @retry_on_busy
     def remove_teacher_from_subject(subject_id, teacher_id):
         """Removes a teacher's assignment from a subject."""
         conn = get_db_connection()
@@ -840,6 +1184,7 @@ class Subject:
             )
             conn.commit()
             conn.close()
+            cache_versions.bump(cache_versions.TEACHER_ACCESS)
             return True
         except Exception as e:
             conn.close()
@@ -859,36 +1204,96 @@ class Subject:
         conn.close()
         return teachers
 
+# One row per student, subject, exam type and academic year (migration 9):
+# entering marks again for the same exam replaces them, and the row counts
+# as newly entered, as a fresh insert used to
+UPSERT_RESULT = '''
+    INSERT INTO results 
+    (student_id, subject_id, class_id, teacher_id, marks_obtained, total_marks, exam_type, academic_year)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (student_id, subject_id, exam_type, academic_year) DO UPDATE SET
+        class_id = excluded.class_id,
+        teacher_id = excluded.teacher_id,
+        marks_obtained = excluded.marks_obtained,
+        total_marks = excluded.total_marks,
+        created_at = CURRENT_TIMESTAMP,
+        exam_date = CURRENT_DATE
+'''
+
 class Result:
     @staticmethod
+    @retry_on_busy
     def enter_marks(student_id, subject_id, class_id, teacher_id, marks_obtained, total_marks, exam_type, academic_year):
         """Enter marks for a student - student_id is users.id"""
-        conn = get_db_connection()
         try:
-            valid_subject = conn.execute('''
-                SELECT 1 FROM class_subjects 
-                WHERE class_id = ? AND subject_id = ?
-            ''', (class_id, subject_id)).fetchone()
-            
-            if not valid_subject:
-                conn.close()
-                return None, "Subject not assigned to student's class"
-            
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO results 
-                (student_id, subject_id, class_id, teacher_id, marks_obtained, total_marks, exam_type, academic_year)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (student_id, subject_id, class_id, teacher_id,
-                  marks_obtained, total_marks, exam_type, academic_year))
-            
-            result_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            return result_id, "Marks entered successfully"
+            return write_queue.write(Result._insert_marks, student_id, subject_id, class_id, teacher_id,
+                                     marks_obtained, total_marks, exam_type, academic_year)
         except sqlite3.IntegrityError as e:
-            conn.close()
             return None, f"Error entering marks: {str(e)}"
+
+    @staticmethod
+    def _insert_marks(conn, student_id, subject_id, class_id, teacher_id, marks_obtained, total_marks, exam_type, academic_year):
+        valid_subject = conn.execute('''
+            SELECT 1 FROM class_subjects 
+            WHERE class_id = ? AND subject_id = ?
+        ''', (class_id, subject_id)).fetchone()
+        
+        if not valid_subject:
+            return None, "Subject not assigned to student's class"
+        
+        conn.execute(UPSERT_RESULT, (student_id, subject_id, class_id, teacher_id,
+                                     marks_obtained, total_marks, exam_type, academic_year))
+        # lastrowid is stale when the upsert updated an existing row
+        result_id = conn.execute('''
+            SELECT id FROM results
+            WHERE student_id = ? AND subject_id = ? AND exam_type IS ? AND academic_year IS ?
+            ORDER BY id DESC LIMIT 1
+        ''', (student_id, subject_id, exam_type, academic_year)).fetchone()[0]
+        return result_id, "Marks entered successfully"
+    
+    @staticmethod
+    @retry_on_busy
+    def enter_marks_bulk(entries):
+        """
+        Enter marks for many students in one transaction. Marks already
+        entered for the same student, subject and exam are replaced.
+
+        entries is a list of (student_id, subject_id, class_id, teacher_id,
+        marks_obtained, total_marks, exam_type, academic_year) tuples.
+        Returns a (success, message) tuple for each entry, in order.
+        """
+        if not entries:
+            return []
+        
+        try:
+            return write_queue.write(Result._insert_marks_bulk, entries)
+        except sqlite3.IntegrityError as e:
+            return [(False, f"Error entering marks: {str(e)}")] * len(entries)
+
+    @staticmethod
+    def _insert_marks_bulk(conn, entries):
+        # One query validates every (class, subject) pair in the batch
+        subject_ids = sorted({entry[1] for entry in entries})
+        placeholders = ', '.join('?' * len(subject_ids))
+        valid_pairs = {
+            (row['class_id'], row['subject_id'])
+            for row in conn.execute(f'''
+                SELECT class_id, subject_id FROM class_subjects
+                WHERE subject_id IN ({placeholders})
+            ''', subject_ids).fetchall()
+        }
+        
+        outcomes = []
+        rows = []
+        for entry in entries:
+            if (entry[2], entry[1]) in valid_pairs:
+                rows.append(entry)
+                outcomes.append((True, "Marks entered successfully"))
+            else:
+                outcomes.append((False, "Subject not assigned to student's class"))
+        
+        conn.executemany(UPSERT_RESULT, rows)
+        return outcomes
     
     @staticmethod
     def get_student_results(student_id):
@@ -943,6 +1348,60 @@ class Result:
         conn.close()
         return results
 
+    @staticmethod
+    def get_results_page(after=None, limit=PAGE_SIZE, class_id=None, subject_id=None,
+                         exam_type=None, academic_year=None):
+        """
+        One page of get_all_results, newest first (created_at, id), with
+        optional filters. after is the cursor returned with the previous
+        page. Returns (results, next_cursor).
+        """
+        where, params = [], []
+        for column, value in (('class_id', class_id), ('subject_id', subject_id),
+                              ('exam_type', exam_type), ('academic_year', academic_year)):
+            if value:
+                where.append(f'r.{column} = ?')
+                params.append(value)
+        key = decode_cursor(after, 2)
+        if key:
+            where.append('(r.created_at, r.id) < (?, ?)')
+            params.extend(key)
+
+        conn = get_db_connection()
+        results, next_cursor = fetch_page(conn, f'''
+            SELECT 
+                r.*,
+                s.subject_name,
+                u.name as student_name,
+                c.class_name,
+                c.section,
+                t.name as teacher_name,
+                (r.marks_obtained * 100.0 / r.total_marks) as percentage
+            FROM results r
+            JOIN subjects s ON r.subject_id = s.id
+            JOIN users u ON r.student_id = u.id
+            JOIN classes c ON r.class_id = c.id
+            JOIN users t ON r.teacher_id = t.id
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            ORDER BY r.created_at DESC, r.id DESC
+            LIMIT ?
+        ''', params, limit, lambda row: (row['created_at'], row['id']))
+        conn.close()
+        return results, next_cursor
+
+    @staticmethod
+    def get_filter_options():
+        """Distinct exam types and academic years, for the results filters."""
+        conn = get_db_connection()
+        exam_types = [row[0] for row in conn.execute(
+            "SELECT DISTINCT exam_type FROM result_stats_exam WHERE exam_type != '' AND result_count > 0 ORDER BY exam_type"
+        ).fetchall()]
+        academic_years = [row[0] for row in conn.execute(
+            "SELECT DISTINCT academic_year FROM result_stats_exam WHERE academic_year != '' AND result_count > 0 ORDER BY academic_year DESC"
+        ).fetchall()]
+        conn.close()
+        return exam_types, academic_years
+
     @staticmethod
     def get_result_by_id(result_id):
         """Gets a single result by its ID, with all related info."""
@@ -965,36 +1424,40 @@ class Result:
         return result
 
     @staticmethod
+    @retry_on_busy
     def update_marks(result_id, marks_obtained, total_marks, exam_type, academic_year):
         """Updates an existing result."""
-        conn = get_db_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE results SET
-                marks_obtained = ?,
-                total_marks = ?,
-                exam_type = ?,
-                academic_year = ?
-                WHERE id = ?
-            ''', (marks_obtained, total_marks, exam_type, academic_year, result_id))
-            conn.commit()
-            conn.close()
+            write_queue.write(Result._update_marks, result_id, marks_obtained, total_marks,
+                              exam_type, academic_year)
             return True, "Result updated successfully"
+        except sqlite3.IntegrityError:
+            return False, "This student already has a result for that subject, exam type and academic year"
         except Exception as e:
-            conn.close()
             return False, f"Error updating result: {str(e)}"
 
     @staticmethod
+    def _update_marks(conn, result_id, marks_obtained, total_marks, exam_type, academic_year):
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE results SET
+            marks_obtained = ?,
+            total_marks = ?,
+            exam_type = ?,
+            academic_year = ?
+            WHERE id = ?
+        ''', (marks_obtained, total_marks, exam_type, academic_year, result_id))
+
+    @staticmethod
+    @retry_on_busy
     def delete_result(result_id):
         """Deletes a single result by its ID."""
-        conn = get_db_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM results WHERE id = ?', (result_id,))
-            conn.commit()
-            conn.close()
+            write_queue.write(Result._delete_result, result_id)
             return True, "Result deleted successfully"
         except Exception as e:
-            conn.close()
-            return False, f"Error deleting result: {str(e)}"
\ No newline at end of file
+            return False, f"Error deleting result: {str(e)}"
+
+    @staticmethod
+    def _delete_result(conn, result_id):
+        conn.execute('DELETE FROM results WHERE id = ?', (result_id,))
\ No newline at end of file
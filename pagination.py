@@ -0,0 +1,52 @@
+"""
+Keyset (seek) pagination helpers.
+
+A page is fetched with "WHERE (sort key) > (last key seen) ORDER BY sort key
+LIMIT n" instead of OFFSET, so every page costs an index seek plus n rows
+however deep the user pages. The last key of a page is handed to the client
+as an opaque cursor (?after=...) and decoded on the next request.
+"""
+import base64
+import json
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """The key values in a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def page_size(value):
+    """A requested page size clamped to 1..MAX_PAGE_SIZE."""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+
+
+def fetch_page(conn, sql, params, limit, key):
+    """
+    Run a page query that selects up to limit + 1 rows. Returns (rows,
+    next_cursor); next_cursor is None on the last page. key(row) gives the
+    sort key values of a row.
+    """
+    rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
@@ -0,0 +1,138 @@
+"""
+Parallel password hashing for bulk account creation.
+
+generate_password_hash is a deliberately slow KDF, so hashing thousands of
+imported accounts in the request thread keeps one core busy for minutes.
+hash_passwords() spreads a batch over a process pool sized to the machine's
+cores and returns straight away; the importer writes the previous chunk to
+the database while the next one is being hashed, and only waits when it
+needs the hashes. The results are ordinary werkzeug hashes, so
+check_password_hash accepts them like any other.
+
+Workers are started by a fork server (spawned, where there is none) rather
+than forked from the app: the pool starts lazily in an import job's thread
+while request threads hold locks that a fork would copy half-taken. Either
+way each worker imports the main module again, so app.py starts its
+background services only in the parent process.
+
+If a process pool cannot be started (no fork/semaphore support) the batch is
+hashed in the calling thread instead. A pool that breaks (a worker killed,
+say) is thrown away and the next batch starts a new one; the slices it
+lost are hashed in the calling thread.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash
+
+import metrics
+
+_executor = None
+_executor_workers = 0
+_pool_unavailable = False
+
+
+def _workers():
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def _mp_context():
+    try:
+        context = multiprocessing.get_context('forkserver')
+    except ValueError:
+        return multiprocessing.get_context('spawn')
+    # The fork server only needs this module; workers fork from it ready to hash
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _hash_slice(passwords):
+    """(hashes, seconds spent hashing each one); timed here so pool workers need no metrics of their own."""
+    timings = []
+    hashes = []
+    for password in passwords:
+        start = time.perf_counter()
+        hashes.append(generate_password_hash(password))
+        timings.append(time.perf_counter() - start)
+    return hashes, timings
+
+
+def get_executor():
+    """The shared hashing pool, started on first use (None if unavailable)."""
+    global _executor, _executor_workers, _pool_unavailable
+    if _executor is None and not _pool_unavailable:
+        try:
+            _executor_workers = _workers()
+            _executor = ProcessPoolExecutor(max_workers=_executor_workers, mp_context=_mp_context())
+        except (OSError, NotImplementedError, ImportError):
+            _pool_unavailable = True
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _discard(executor):
+    """Drop a broken pool so the next batch starts a fresh one."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _done(passwords):
+    done = Future()
+    done.set_result(_hash_slice(passwords))
+    return done
+
+
+class HashBatch:
+    """Hashes being computed for one batch of passwords, in input order."""
+
+    def __init__(self, slices, executor=None):
+        # (future, passwords) per slice
+        self.slices = slices
+        self.executor = executor
+
+    def result(self):
+        hashes = []
+        for future, passwords in self.slices:
+            try:
+                slice_hashes, timings = future.result()
+            except BrokenProcessPool:
+                _discard(self.executor)
+                slice_hashes, timings = _hash_slice(passwords)
+            hashes.extend(slice_hashes)
+            for seconds in timings:
+                metrics.PASSWORD_HASH_SECONDS.observe(seconds)
+        return hashes
+
+
+def hash_passwords(passwords):
+    """
+    Start hashing passwords in the process pool and return a HashBatch.
+    The batch is split into one slice per worker so a single chunk already
+    uses every core.
+    """
+    passwords = [str(password) for password in passwords]
+    executor = get_executor()
+    if executor is None or not passwords:
+        return HashBatch([(_done(passwords), passwords)])
+
+    size = -(-len(passwords) // _executor_workers)
+    slices = [passwords[start:start + size] for start in range(0, len(passwords), size)]
+    try:
+        return HashBatch([(executor.submit(_hash_slice, part), part) for part in slices], executor)
+    except RuntimeError:
+        # Pool broken or shut down (e.g. a worker was killed); hash inline
+        _discard(executor)
+        return HashBatch([(_done(passwords), passwords)])
@@ -0,0 +1,84 @@
+"""
+Per-request query-count regression check.
+
+Pages that list one thing per class (or per student) should cost the same
+number of SQL statements however many there are; a count that grows with
+the data is an N+1 loop. Each check requests a route for a small and a
+large data set in a scratch database and compares the X-SQL-Count headers
+sql_profiler adds to each response (SQL_HEADERS is switched on here).
+
+    python manage.py check-queries
+"""
+import os
+import tempfile
+
+import database
+
+# Classes taking the subject in the large data set
+MANY_CLASSES = 12
+STUDENTS_PER_CLASS = 3
+
+
+def _seed(teacher_id, code, class_count, password_hash):
+    """A subject taught by teacher_id in class_count classes with students."""
+    from models import Class, Student, Subject
+
+    subject_id = Subject.create_subject(f'Subject {code}', code)
+    Subject.assign_teacher_to_subject(subject_id, teacher_id)
+    students = []
+    for number in range(class_count):
+        class_id, _ = Class.create_class(f'Class {code}', str(number + 1), teacher_id)
+        Class.add_subject_to_class(class_id, subject_id)
+        for roll in range(1, STUDENTS_PER_CLASS + 1):
+            students.append((f'{code}{number} Student{roll}', 'Female', '2010-01-01', class_id,
+                             roll, 'Father', '9000000000', 'Mother',
+                             f'{code.lower()}{number}-{roll}@example.com', '2024-2025'))
+    Student.create_students_bulk(students, [password_hash] * len(students))
+    return subject_id
+
+
+def check_query_counts():
+    """
+    Returns a list of (label, small count, large count) for routes whose
+    query count changes with the size of the data.
+    """
+    from werkzeug.security import generate_password_hash
+
+    scratch_dir = tempfile.mkdtemp(prefix='query-count-')
+    previous = database.get_pool()
+    database.configure_pool(os.path.join(scratch_dir, 'counts.db'))
+    # Imported late so the app starts against the scratch database
+    from app import app
+    from models import User
+
+    failures = []
+    try:
+        app.config['SQL_PROFILING'] = True
+        app.config['SQL_HEADERS'] = True
+        database.init_db()
+        teacher_id = User.create_user('count-teacher', 'count-pw', 'teacher', 'Count Teacher',
+                                      'count-teacher@example.com')
+        password_hash = generate_password_hash('2010-01-01')
+        one_class = _seed(teacher_id, 'ONE', 1, password_hash)
+        many_classes = _seed(teacher_id, 'MANY', MANY_CLASSES, password_hash)
+
+        client = app.test_client()
+        client.post('/login', data={'username': 'count-teacher', 'password': 'count-pw'})
+        checks = [
+            ('enter_marks_by_subject', '/teacher/enter_marks_by_subject/{}'),
+        ]
+        for label, url in checks:
+            # The first request also fills the session caches
+            client.get(url.format(one_class))
+            counts = []
+            for subject_id in (one_class, many_classes):
+                response = client.get(url.format(subject_id))
+                if response.status_code != 200:
+                    raise RuntimeError(f"{label} returned {response.status_code}")
+                counts.append(int(response.headers['X-SQL-Count']))
+            if counts[0] != counts[1]:
+                failures.append((label, counts[0], counts[1]))
+    finally:
+        database.configure_pool(previous.database, previous.max_idle,
+                                previous.profile, previous.pragmas)
+    return failures
@@ -0,0 +1,117 @@
+"""
+EXPLAIN QUERY PLAN regression check for the model layer.
+
+Every read method in models.py is called once against a scratch database
+built by init_db(). Each SELECT it issues is captured with the connection's
+trace callback and explained; a plain "SCAN <table>" (a full table scan
+without an index) fails the check unless that table is listed as an
+expected scan for the method, e.g. listing every subject.
+
+    python manage.py check-plans
+"""
+import os
+import tempfile
+
+from flask import Flask
+
+import database
+from models import Enrollment, User, Student, Class, Subject, Result
+from pagination import encode_cursor
+
+# (label, call, tables that may legitimately be scanned in full)
+MODEL_QUERIES = [
+    ('Enrollment.get_student_classes', lambda: Enrollment.get_student_classes(1), set()),
+    ('User.get_by_username', lambda: User.get_by_username('admin'), set()),
+    ('User.get_by_id', lambda: User.get_by_id(1), set()),
+    ('User.get_all_users', lambda: User.get_all_users(), set()),
+    ('User.get_all_users_with_details', lambda: User.get_all_users_with_details(), set()),
+    ('User.get_users_page', lambda: User.get_users_page(after=encode_cursor(['student', 'a', 1])), set()),
+    ('User.get_students', lambda: User.get_students(), set()),
+    ('User.get_teachers', lambda: User.get_teachers(), set()),
+    ('User.get_subjects_taught', lambda: User.get_subjects_taught(1), set()),
+    ('User.get_teacher_access', lambda: User.get_teacher_access(1), set()),
+    ('User.get_teachable_subjects_for_class', lambda: User.get_teachable_subjects_for_class(1, 1), set()),
+    ('User.get_students_in_class', lambda: User.get_students_in_class(1), set()),
+    ('Student.get_all_students', lambda: Student.get_all_students(), set()),
+    ('Student.get_students_page',
+     lambda: Student.get_students_page(after=encode_cursor(['10', 'A', 1]), academic_year='2024'), set()),
+    ('Student.get_student_by_id', lambda: Student.get_student_by_id(1), set()),
+    ('Student.get_student_by_user_id', lambda: Student.get_student_by_user_id(1), set()),
+    ('Student.search_students', lambda: Student.search_students('ab'), set()),
+    # checks whether the trigram table exists (older SQLite lacks it)
+    ('Student.search_students (substring)', lambda: Student.search_students('sharma'), {'sqlite_master'}),
+    ('Class.get_all_classes', lambda: Class.get_all_classes(), set()),
+    ('Class.get_class_by_id', lambda: Class.get_class_by_id(1), set()),
+    ('Class.get_classes_by_teacher', lambda: Class.get_classes_by_teacher(1), set()),
+    ('Class.get_subjects_for_class', lambda: Class.get_subjects_for_class(1), set()),
+    ('Class.get_available_subjects_for_class', lambda: Class.get_available_subjects_for_class(1), set()),
+    ('Class.get_classes_for_subject', lambda: Class.get_classes_for_subject(1), set()),
+    ('Class.get_rosters_for_subject', lambda: Class.get_rosters_for_subject(1), set()),
+    ('Subject.get_all_subjects', lambda: Subject.get_all_subjects(), set()),
+    ('Subject.get_subject_by_id', lambda: Subject.get_subject_by_id(1), set()),
+    ('Subject.get_teachers_for_subject', lambda: Subject.get_teachers_for_subject(1), set()),
+    ('Result.get_student_results', lambda: Result.get_student_results(1), set()),
+    ('Result.get_class_results', lambda: Result.get_class_results(1), set()),
+    ('Result.get_all_results', lambda: Result.get_all_results(), set()),
+    ('Result.get_results_page', lambda: Result.get_results_page(after=encode_cursor(['2024-01-01', 1])), set()),
+    ('Result.get_results_page (filtered)',
+     lambda: Result.get_results_page(class_id=1, subject_id=1, exam_type='Final', academic_year='2024'), set()),
+    ('Result.get_result_by_id', lambda: Result.get_result_by_id(1), set()),
+]
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+
+
+def full_scans(plan):
+    """Tables/aliases read with a plain SCAN (no index) in a plan."""
+    scans = []
+    for detail in plan:
+        # FTS5 tables report "SCAN <table> VIRTUAL TABLE INDEX ..." for a
+        # MATCH lookup, which reads the full-text index, not every row;
+        # "SCAN (subquery-N)" reads an already limited subquery
+        if detail.startswith('SCAN ') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+            table = detail.split()[1]
+            if not table.startswith('('):
+                scans.append(table)
+    return scans
+
+
+def check_query_plans(verbose=False):
+    """
+    Run every model query against a scratch database and return a list of
+    (label, sql, plan) tuples whose plan contains an unexpected full scan.
+    """
+    scratch_dir = tempfile.mkdtemp(prefix='plan-check-')
+    app = Flask('plan-check')
+    app.config['DATABASE'] = os.path.join(scratch_dir, 'plans.db')
+    previous = database.get_pool()
+    database.init_app(app)
+
+    failures = []
+    try:
+        with app.app_context():
+            database.init_db()
+            conn = database.get_db_connection()
+            for label, call, allowed in MODEL_QUERIES:
+                statements = []
+                conn.set_trace_callback(statements.append)
+                try:
+                    call()
+                finally:
+                    conn.set_trace_callback(None)
+                for sql in statements:
+                    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                        continue
+                    plan = explain(conn, sql)
+                    unexpected = [t for t in full_scans(plan) if t not in allowed]
+                    if verbose:
+                        print(f"{label}: {'; '.join(plan)}")
+                    if unexpected:
+                        failures.append((label, sql, plan))
+            conn.close()
+    finally:
+        database.configure_pool(previous.database, previous.max_idle,
+                                previous.profile, previous.pragmas)
+    return failures
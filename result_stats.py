@@ -0,0 +1,127 @@
+"""
+Summary tables for result statistics.
+
+The result_stats_* tables hold running counts and sums per subject, class,
+student and exam (exam_type + academic_year). Triggers on results (created by
+migration 4) keep them current on every insert, update and delete, so the
+dashboards read a handful of rows instead of aggregating the whole results
+table. A result's percentage is marks_obtained * 100 / total_marks and it
+counts as a pass at 50% or more.
+
+rebuild() recomputes everything from the results table; verify() compares
+the maintained totals with a fresh aggregate.
+"""
+
+STATS_TABLES = [
+    'result_stats_subject', 'result_stats_class', 'result_stats_student',
+    'result_stats_exam', 'result_stats_subject_student', 'result_stats_class_student',
+]
+
+PERCENTAGE = '(marks_obtained * 100.0 / total_marks)'
+
+
+def rebuild(conn):
+    """Recompute every summary table from results (caller commits)."""
+    for table in STATS_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+
+    conn.execute('''
+        INSERT INTO result_stats_subject_student (subject_id, student_id, result_count)
+        SELECT subject_id, student_id, COUNT(*) FROM results GROUP BY subject_id, student_id
+    ''')
+    conn.execute('''
+        INSERT INTO result_stats_class_student (class_id, student_id, result_count)
+        SELECT class_id, student_id, COUNT(*) FROM results GROUP BY class_id, student_id
+    ''')
+
+    totals = f'''
+        COUNT(*), COUNT({PERCENTAGE}), IFNULL(SUM({PERCENTAGE}), 0),
+        IFNULL(SUM({PERCENTAGE} >= 50), 0)
+    '''
+    conn.execute(f'''
+        INSERT INTO result_stats_subject
+            (subject_id, result_count, graded_count, percentage_sum, pass_count, student_count)
+        SELECT subject_id, {totals}, COUNT(DISTINCT student_id)
+        FROM results GROUP BY subject_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO result_stats_class
+            (class_id, result_count, graded_count, percentage_sum, pass_count, student_count)
+        SELECT class_id, {totals}, COUNT(DISTINCT student_id)
+        FROM results GROUP BY class_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO result_stats_student
+            (student_id, result_count, graded_count, percentage_sum, pass_count, subject_count)
+        SELECT student_id, {totals}, COUNT(DISTINCT subject_id)
+        FROM results GROUP BY student_id
+    ''')
+    conn.execute(f'''
+        INSERT INTO result_stats_exam
+            (exam_type, academic_year, result_count, graded_count, percentage_sum, pass_count)
+        SELECT IFNULL(exam_type, ''), IFNULL(academic_year, ''), {totals}
+        FROM results GROUP BY IFNULL(exam_type, ''), IFNULL(academic_year, '')
+    ''')
+
+
+def verify(conn, tolerance=1e-6):
+    """
+    Compare the maintained summaries with a fresh aggregate of results.
+    Returns a list of human-readable mismatches (empty when consistent).
+    """
+    problems = []
+    checks = [
+        ('result_stats_subject', 'subject_id', 'COUNT(DISTINCT student_id)', 'student_count'),
+        ('result_stats_class', 'class_id', 'COUNT(DISTINCT student_id)', 'student_count'),
+        ('result_stats_student', 'student_id', 'COUNT(DISTINCT subject_id)', 'subject_count'),
+    ]
+    for table, key, distinct_sql, distinct_col in checks:
+        expected = {
+            row[0]: tuple(row[1:]) for row in conn.execute(f'''
+                SELECT {key}, COUNT(*), COUNT({PERCENTAGE}), IFNULL(SUM({PERCENTAGE}), 0),
+                       IFNULL(SUM({PERCENTAGE} >= 50), 0), {distinct_sql}
+                FROM results GROUP BY {key}
+            ''')
+        }
+        actual = {
+            row[0]: tuple(row[1:]) for row in conn.execute(f'''
+                SELECT {key}, result_count, graded_count, percentage_sum, pass_count, {distinct_col}
+                FROM {table} WHERE result_count > 0
+            ''')
+        }
+        for key_value in set(expected) | set(actual):
+            want = expected.get(key_value)
+            got = actual.get(key_value)
+            if want is None or got is None or not _same(want, got, tolerance):
+                problems.append(f"{table} {key}={key_value}: expected {want}, found {got}")
+    return problems
+
+
+def _same(want, got, tolerance):
+    return all(
+        abs(a - b) <= tolerance * max(1.0, abs(a)) if isinstance(a, float) or isinstance(b, float)
+        else a == b
+        for a, b in zip(want, got)
+    )
+
+
+def overall(conn):
+    """Totals across all results, read from the per-subject rows."""
+    row = conn.execute('''
+        SELECT IFNULL(SUM(result_count), 0) as total_results,
+               IFNULL(SUM(graded_count), 0) as graded_count,
+               IFNULL(SUM(percentage_sum), 0) as percentage_sum,
+               IFNULL(SUM(pass_count), 0) as pass_count
+        FROM result_stats_subject
+    ''').fetchone()
+    # Served by the expression index on results
+    topper = conn.execute(
+        f'SELECT MAX({PERCENTAGE}) FROM results'
+    ).fetchone()[0]
+    total = row['total_results']
+    return {
+        'total_results': total,
+        'average_percentage': row['percentage_sum'] / row['graded_count'] if row['graded_count'] else 0,
+        'pass_percentage': row['pass_count'] * 100.0 / total if total else 0,
+        'topper_score': topper or 0,
+    }
@@ -0,0 +1,136 @@
+"""
+Per-request SQL instrumentation.
+
+Every connection a request uses is handed the request's QueryProfile (see
+database.get_db_connection), and PooledConnection times each execute()
+against it. In development (SQL_HEADERS, on by default when app.debug)
+the totals go out as response headers:
+
+    X-SQL-Count       statements executed
+    X-SQL-Time-Ms     time spent in execute() calls
+    X-SQL-Repeated    most executions of one statement text; a number that
+                      grows with the page's data is an N+1 loop
+
+and (SQL_DEBUG_PANEL, likewise on by default when app.debug) pages built
+on base.html also show a panel with the slowest and most repeated
+statements. In production the profile only feeds the slow-request log: a
+request over SQL_LOG_MAX_QUERIES statements, SQL_LOG_MAX_MS milliseconds
+of SQL or SQL_REPEAT_THRESHOLD runs of one statement is logged as one
+JSON line on the "sql_profiler" logger.
+
+Times cover preparing a statement and stepping to its first row; fetching
+the remaining rows is not included.
+"""
+import json
+import logging
+import time
+
+from flask import g, request
+
+logger = logging.getLogger('sql_profiler')
+
+# Slowest statements kept per request
+SLOWEST_LIMIT = 5
+
+
+class QueryProfile:
+    """Statement count and timings for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.total_time = 0.0
+        # statement text -> [executions, total seconds, slowest seconds]
+        self.statements = {}
+
+    def record(self, sql, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        stats = self.statements.get(sql)
+        if stats is None:
+            self.statements[sql] = [1, elapsed, elapsed]
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def max_repeats(self):
+        return max((stats[0] for stats in self.statements.values()), default=0)
+
+    def summary(self, repeat_threshold=2):
+        """The profile as a JSON-friendly dict."""
+        by_time = sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)
+        repeated = sorted(((sql, stats) for sql, stats in self.statements.items()
+                           if stats[0] >= repeat_threshold),
+                          key=lambda item: item[1][0], reverse=True)
+        return {
+            'count': self.count,
+            'sql_ms': round(self.total_time * 1000, 2),
+            'request_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'slowest': [{'sql': _compact(sql), 'ms': round(stats[2] * 1000, 2), 'count': stats[0]}
+                        for sql, stats in by_time[:SLOWEST_LIMIT]],
+            'repeated': [{'sql': _compact(sql), 'count': stats[0],
+                          'total_ms': round(stats[1] * 1000, 2)}
+                         for sql, stats in repeated],
+        }
+
+
+def _compact(sql):
+    return ' '.join(sql.split())
+
+
+def current_profile():
+    """The running request's QueryProfile, or None."""
+    return g.get('_sql_profile')
+
+
+def _development_only(app, key):
+    """A SQL_HEADERS / SQL_DEBUG_PANEL setting; None follows app.debug."""
+    enabled = app.config[key]
+    return app.debug if enabled is None else enabled
+
+
+def init_app(app):
+    app.config.setdefault('SQL_PROFILING', True)
+    # None follows app.debug, which app.run(debug=True) only sets later
+    app.config.setdefault('SQL_HEADERS', None)
+    app.config.setdefault('SQL_DEBUG_PANEL', None)
+    app.config.setdefault('SQL_LOG_MAX_QUERIES', 30)
+    app.config.setdefault('SQL_LOG_MAX_MS', 200)
+    app.config.setdefault('SQL_REPEAT_THRESHOLD', 10)
+
+    @app.before_request
+    def start_profile():
+        if app.config['SQL_PROFILING']:
+            g._sql_profile = QueryProfile()
+
+    @app.after_request
+    def report_profile(response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        if _development_only(app, 'SQL_HEADERS'):
+            response.headers['X-SQL-Count'] = str(profile.count)
+            response.headers['X-SQL-Time-Ms'] = f'{profile.total_time * 1000:.2f}'
+            response.headers['X-SQL-Repeated'] = str(profile.max_repeats())
+
+        threshold = app.config['SQL_REPEAT_THRESHOLD']
+        if (profile.count > app.config['SQL_LOG_MAX_QUERIES']
+                or profile.total_time * 1000 > app.config['SQL_LOG_MAX_MS']
+                or profile.max_repeats() >= threshold):
+            logger.warning(json.dumps({
+                'event': 'sql_budget_exceeded',
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                **profile.summary(threshold),
+            }))
+        return response
+
+    @app.context_processor
+    def sql_debug_panel():
+        profile = current_profile()
+        if profile is None or not _development_only(app, 'SQL_DEBUG_PANEL'):
+            return {}
+        return {'sql_debug': profile.summary()}
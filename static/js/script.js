@@ -1,4 +1,86 @@
 // Additional JavaScript functionality can be added here
 document.addEventListener('DOMContentLoaded', function() {
     // Add any client-side functionality needed
-});
\ No newline at end of file
+});
+
+// An alert holding preformatted text. Import messages quote cells from the
+// uploaded spreadsheet, so they are only ever set as text.
+function importAlert(alertClass, text) {
+    const alert = document.createElement('div');
+    alert.className = `alert ${alertClass}`;
+    const pre = document.createElement('pre');
+    pre.style.whiteSpace = 'pre-wrap';
+    pre.style.wordWrap = 'break-word';
+    pre.textContent = text;
+    alert.appendChild(pre);
+    return alert;
+}
+
+function showImportMessage(container, success, message) {
+    container.replaceChildren(importAlert(success ? 'alert-success' : 'alert-danger', message));
+}
+
+// Show a background import's progress in container until it finishes.
+// Progress is pushed by the server as Server-Sent Events (/jobs/<id>/events).
+// onEnd, if given, is called once the job is done or can no longer be followed.
+function watchImportJob(jobId, container, onEnd) {
+    const source = new EventSource(`/jobs/${jobId}/events`);
+    const errors = [];
+    let progress = null;
+
+    const render = () => {
+        const total = progress.rows_total ? ` of ~${progress.rows_total}` : '';
+        const percent = progress.percent !== null ? progress.percent : 0;
+        const alert = document.createElement('div');
+        alert.className = 'alert alert-info';
+        alert.append(progress.status === 'queued'
+            ? 'Waiting to start...'
+            : `Importing: ${progress.rows_processed}${total} rows in ${progress.chunks_done} chunks ` +
+              `(${progress.rows_succeeded} added, ${progress.rows_failed} failed) ` +
+              `at ${progress.rows_per_second} rows/sec`);
+        const bar = document.createElement('div');
+        bar.className = 'progress mt-2';
+        const fill = document.createElement('div');
+        fill.className = 'progress-bar';
+        fill.style.width = `${percent}%`;
+        bar.appendChild(fill);
+        alert.appendChild(bar);
+        if (errors.length) {
+            const errorList = document.createElement('pre');
+            errorList.className = 'mt-2 mb-0';
+            errorList.style.whiteSpace = 'pre-wrap';
+            errorList.style.wordWrap = 'break-word';
+            errorList.textContent = errors.join('\n');
+            alert.appendChild(errorList);
+        }
+        container.replaceChildren(alert);
+    };
+
+    source.addEventListener('progress', event => {
+        progress = JSON.parse(event.data);
+        render();
+    });
+    source.addEventListener('row_error', event => {
+        errors.push(JSON.parse(event.data).message);
+        if (progress) {
+            render();
+        }
+    });
+    source.addEventListener('done', event => {
+        const done = JSON.parse(event.data);
+        source.close();
+        showImportMessage(container, done.status === 'succeeded', done.message);
+        if (onEnd) {
+            onEnd();
+        }
+    });
+    source.onerror = () => {
+        // A 404 (unknown or expired job) cannot be retried
+        if (source.readyState === EventSource.CLOSED) {
+            container.replaceChildren(importAlert('alert-danger', 'Lost track of this import.'));
+            if (onEnd) {
+                onEnd();
+            }
+        }
+    };
+}
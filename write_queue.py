@@ -0,0 +1,165 @@
+"""
+Optional single-writer queue for result writes.
+
+SQLite takes one writer at a time, so request threads that each commit
+their own mark entry queue up on the write lock and pay for a commit
+apiece. With WRITE_QUEUE switched on, write() instead hands the work to
+one writer thread and waits on a Future. The writer gathers whatever
+arrives within WRITE_QUEUE_INTERVAL_MS of the first write (up to
+WRITE_QUEUE_BATCH_SIZE writes), runs each in its own SAVEPOINT inside a
+single BEGIN IMMEDIATE transaction and commits once for the whole batch.
+A write that raises only rolls back its own savepoint; its caller gets the
+exception, the rest of the batch still commits. A batch that finds the
+database locked is retried with the same backoff as database.retry_on_busy.
+
+Futures are resolved after the commit, so a caller that gets its outcome
+back can read its own write. Statements run by the writer are not part of
+the calling request's SQL profile.
+
+With WRITE_QUEUE off (the default), or inside database.transaction(),
+write() runs the work on the caller's own connection and commits it as
+before.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+import metrics
+
+_writer = None
+
+
+class WriteQueue:
+    """One writer thread that group-commits the writes submitted to it."""
+
+    def __init__(self, batch_size=64, interval=0.002):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(conn, *args); returns a Future for its return value."""
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def stop(self):
+        """Finish the writes already queued, then end the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+            batch = [op]
+            stopping = False
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    op = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        batch = [op for op in batch if op[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                outcomes = self._apply(batch)
+                break
+            except Exception as e:
+                if database.is_busy_error(e) and attempt < database.BUSY_RETRIES:
+                    database.busy_backoff(attempt, 'write_queue', time.perf_counter() - started)
+                    attempt += 1
+                    continue
+                if database.is_busy_error(e):
+                    metrics.DB_LOCK_ERRORS.labels('write_queue').inc()
+                # The transaction is lost, and with it every write in the batch
+                for _, _, future in batch:
+                    future.set_exception(e)
+                return
+
+        metrics.WRITE_BATCH_SIZE.observe(len(batch))
+        for (_, _, future), (result, error) in zip(batch, outcomes):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _apply(self, batch):
+        """Run the batch in one transaction; returns a (result, error) pair per write."""
+        pool = database.get_pool()
+        conn = pool.acquire()
+        outcomes = []
+        try:
+            # A stray commit() inside a write must not end the batch early
+            conn.transaction_depth = 1
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, args, _ in batch:
+                conn.execute('SAVEPOINT queued_write')
+                try:
+                    outcomes.append((fn(conn, *args), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO queued_write')
+                    outcomes.append((None, e))
+                conn.execute('RELEASE queued_write')
+            conn.transaction_depth = 0
+            conn.commit()
+        finally:
+            pool.release(conn)
+        return outcomes
+
+
+def write(fn, *args):
+    """
+    Run fn(conn, *args) in a committed write and return what it returns.
+
+    fn must not commit; exceptions it raises come back to the caller and
+    its writes are rolled back.
+    """
+    if _writer is not None and not database.transaction_active():
+        return _writer.submit(fn, *args).result()
+
+    conn = database.get_db_connection()
+    try:
+        result = fn(conn, *args)
+    except Exception:
+        # Inside transaction() the outermost block rolls back
+        if conn.transaction_depth == 0:
+            conn.rollback()
+        raise
+    else:
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    global _writer
+    app.config.setdefault('WRITE_QUEUE', os.environ.get('SCHOOL_WRITE_QUEUE') == '1')
+    app.config.setdefault('WRITE_QUEUE_BATCH_SIZE', 64)
+    app.config.setdefault('WRITE_QUEUE_INTERVAL_MS', 2)
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+    if app.config['WRITE_QUEUE']:
+        _writer = WriteQueue(app.config['WRITE_QUEUE_BATCH_SIZE'],
+                             app.config['WRITE_QUEUE_INTERVAL_MS'] / 1000)